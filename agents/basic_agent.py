@@ -3,11 +3,15 @@ from typing import Union
 import library as pycc
 
 from config import DEBUG_CHEATS, DEBUG_CONSOLE, DEBUG_LOGS, DEBUG_TEXT, DEBUG_UNIT, DEBUG_VISUAL, FRAME_SKIP, \
-    BUILD_ORDER_PATH, USE_CHOKES, DEBUG_ENEMIES, FRAME_CLEAR_CACHE, USE_MOVE, USE_PFSCOUT, DEBUG_SCOUT
+    BUILD_ORDER_PATH, USE_CHOKES, DEBUG_ENEMIES, FRAME_CLEAR_CACHE, USE_MOVE, USE_PFSCOUT, DEBUG_SCOUT, MAPS
 from modules import BuildOrder, RegionManager, TaskManager, UnitCollection, PyBuildingPlacer, debugging as debug
 from modules.extra import unit_types_by_condition
+from modules.map_bundle import MapBundle, map_data_dir
+from modules.map_grids import MapGrids
+from modules.path_finding.flow_field import FlowFields
+from modules.spatial_index import PointIndex
 import bottlenecks as bottle    # Erik
-from modules.path_finding import vertex #For pathfinding - hanlu520
+from map_analysis import export_grids
 from modules.scout_tester import ScoutTester
 
 
@@ -47,6 +51,14 @@ class BasicAgent(pycc.IDABot):
         self.last_hp_diff = 0
 
         self.use_scout = True
+
+        # Path of the map file, set by run_sc2. Keys the precompiled map data in map_bundle
+        self.map_path: str = None
+        # Write the grids of the map to its data directory at game start, as input for map_analysis
+        self.export_map_grids = False
+        self.map_bundle: MapBundle = None
+        self.map_grids: MapGrids = None  # Set in on_game_start
+        self.flow_fields: FlowFields = None  # Set in on_game_start if USE_MOVE
         # self.latest_pfscout_unit = None
         self.latest_scout_unit = None
 
@@ -75,6 +87,11 @@ class BasicAgent(pycc.IDABot):
             self.timer = TicToc(prints=DEBUG_CONSOLE)
             self.logger = Logger()
 
+    @property
+    def map_file(self) -> str:
+        """The map file played, the first of MAPS when run_sc2 did not set map_path"""
+        return self.map_path or MAPS[0]
+
     @cached_property
     def non_start_bases(self) -> frozenset:
         return frozenset(base for base in self.base_location_manager.base_locations
@@ -82,15 +99,9 @@ class BasicAgent(pycc.IDABot):
                                   or base.is_player_start_location(pycc.PLAYER_ENEMY))))
 
     @cached_property
-    def vertex_dict(self):
-        # Safe-path init for vertex with all neccessary vertex data
-        vertex_dict = {}
-        for y in range(self.map_tools.height):
-            for x in range(self.map_tools.width):
-                if (self.map_tools.is_walkable(x, y)):
-                    current_point = (x, y)
-                    vertex_dict[current_point] = (vertex.Vertex(current_point))
-        return vertex_dict
+    def non_start_base_index(self) -> PointIndex:
+        return PointIndex(sorted(self.non_start_bases, key=lambda base: (base.position.x, base.position.y)),
+                          lambda base: base.position)
 
     def on_game_start(self) -> None:
         """Runs on game start. Loads necessary data and generates settings"""
@@ -98,17 +109,22 @@ class BasicAgent(pycc.IDABot):
         self.tech_tree.suppress_warnings(True)
         self.WORKER_TYPES = unit_types_by_condition(self, lambda u: u.is_worker)
         self.COMBAT_TYPES = unit_types_by_condition(self, lambda u: u.is_combat_unit)
+        if self.map_path:
+            self.map_bundle = MapBundle.for_map(self.map_path)
+        self.map_grids = MapGrids(self)
+        if self.export_map_grids:
+            export_grids(self, map_data_dir(self.map_file))
+        if USE_MOVE:
+            self.flow_fields = FlowFields(self)
 
         start_base_pos = self.base_location_manager.get_player_starting_base_location(
             pycc.PLAYER_SELF).position
         if USE_CHOKES:
             self.BOTTLENECKS = bottle.get_bottlenecks(self, start_base_pos)    # ERIk
-        if USE_MOVE:
-            # init vertex_dict
-            _ = self.vertex_dict
+            self.WALLOFF_LAYOUT = bottle.get_walloff_layout(self, start_base_pos)
         if USE_PFSCOUT:
             self.region_manager.on_start()
-            _ = self.non_start_bases # init non_start_bases
+            _ = self.non_start_base_index # init non_start_bases
         if DEBUG_VISUAL:
             self.set_up_debugging()
             self.debugger.on_start()
@@ -147,6 +163,7 @@ class BasicAgent(pycc.IDABot):
             self.task_manager.on_step(new_units)
 
             self.unit_collection.remove_dead_units()
+            self.map_grids.update(self.unit_collection)
         else:
             self.task_manager.on_step_every_frame()
 
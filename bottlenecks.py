@@ -4,79 +4,210 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 from library import Point2DI, Point2D
+import heapq
+from collections import deque
 import math
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+
+from modules.map_bundle import load_or_build
 
 if TYPE_CHECKING:
     from agents.basic_agent import BasicAgent
 
+DEPOT_SIZE = 2  # Width and height of a supply depot in tiles
+
+
 def get_bottlenecks(agent: BasicAgent, start_base_pos: Point2DI) -> list[list]:
     """ Beskrivning """
- 
-    gate_pairs = generate_bottleneck_bounds(agent)
+
+    return [[Point2DI(x, y) for x, y in bottleneck.tolist()]
+            for bottleneck in sort_bottlenecks(agent, get_bottleneck_arrays(agent), start_base_pos)]
+
+
+def get_bottleneck_arrays(agent: BasicAgent) -> list[np.ndarray]:
+    """ The bottlenecks of find_bottlenecks, from the map bundle when there is one """
+    if agent.map_bundle is None:
+        return find_bottlenecks(agent)
+    # The bottlenecks only depend on the map, so they are found once and kept in the map bundle
+    return agent.map_bundle.get_ragged("bottlenecks", lambda: find_bottlenecks(agent))
+
+
+def get_walloff_layout(agent: BasicAgent, start_base_pos: Point2DI) -> list[Point2DI]:
+    """ Returns the supply depot positions of walloff_layout for the bottlenecks sorted from the start base """
+    def build():
+        bottlenecks = sort_bottlenecks(agent, get_bottleneck_arrays(agent), start_base_pos)
+        return walloff_layout(agent.map_grids.buildable, bottlenecks)
+
+    # Kept in the map bundle for each start location, since the order of the bottlenecks depends on it
+    name = f"walloff_{int(start_base_pos.x)}_{int(start_base_pos.y)}"
+    return [Point2DI(x, y) for x, y in load_or_build(agent.map_bundle, name, build).tolist()]
+
+
+def walloff_layout(buildable: np.ndarray, bottlenecks: list[np.ndarray]) -> np.ndarray:
+    """
+    Returns positions of supply depots that cover the tiles of the bottlenecks, as a (N, 2) array of the (x, y) of
+    the lowest tile of each 2x2 footprint, in the order of the bottlenecks. Each tile of a bottleneck that is not
+    covered yet gets the depot of the four containing it that covers the most uncovered tiles of the bottleneck, among
+    the ones on buildable tiles that do not overlap a depot already placed. Tiles without such a depot stay uncovered.
+    """
+    height, width = buildable.shape
+    taken = np.zeros(buildable.shape, dtype=bool)
+    positions = []
+    for bottleneck in bottlenecks:
+        tiles = set(map(tuple, bottleneck.tolist()))
+        covered = set()
+        for x, y in bottleneck.tolist():
+            if (x, y) in covered:
+                continue
+            best, best_cover = None, set()
+            for ox, oy in ((x - 1, y - 1), (x, y - 1), (x - 1, y), (x, y)):
+                if not (0 <= ox <= width - DEPOT_SIZE and 0 <= oy <= height - DEPOT_SIZE):
+                    continue
+                footprint = (slice(oy, oy + DEPOT_SIZE), slice(ox, ox + DEPOT_SIZE))
+                if not buildable[footprint].all() or taken[footprint].any():
+                    continue
+                cover = {(fx, fy) for fx in range(ox, ox + DEPOT_SIZE) for fy in range(oy, oy + DEPOT_SIZE)
+                         if (fx, fy) in tiles} - covered
+                if len(cover) > len(best_cover):
+                    best, best_cover = (ox, oy), cover
+            if best is not None:
+                taken[best[1]:best[1] + DEPOT_SIZE, best[0]:best[0] + DEPOT_SIZE] = True
+                covered |= best_cover
+                positions.append(best)
+
+    return np.array(positions, dtype=np.int32).reshape(-1, 2)
+
+
+def find_bottlenecks(agent: BasicAgent) -> list[np.ndarray]:
+    """ Returns the bottlenecks of the map as (N, 2) arrays of the (x, y) of their tiles, unsorted """
+
+    gate_pairs = [gate_pair for gate_pair in generate_bottleneck_bounds(agent) if len(gate_pair) > 1]
+    walkable = agent.map_grids.walkable
+    wall_adjacent = get_depth_map(walkable, agent.map_grids.valid) == 1
+    paths = build_gates(walkable, [(gate_pair[0], gate_pair[1]) for gate_pair in gate_pairs])
 
     complete_bottlenecks = []
-    for gate_pair in gate_pairs:
-        if len(gate_pair) > 1:
-            bottleneck = build_gate(agent, gate_pair) #
+    for path in paths:
+        if path is not None:
+            bottleneck = refine_bottleneck(wall_adjacent, path)
             if len(bottleneck) < 13: # Bottlenecks longer than 12 are too long
                 complete_bottlenecks.append(bottleneck)
 
-    return sort_bottlenecks(agent, complete_bottlenecks, start_base_pos)
+    return complete_bottlenecks
 
 
 def set_tile_depths(agent: BasicAgent) -> dict:
-    """ Returns a dict where each depth has associated tiles """
-    last_found_depth = 1   
+    """ Returns a dict where each depth has associated tiles, see get_depth_map """
+    depth_map = get_depth_map(agent.map_grids.walkable, agent.map_grids.valid)
     depths = {}  # Map of depths and their associated tiles
 
-    for y in range(agent.map_tools.height):
-        for x in range(agent.map_tools.width):
-            tile = Point2DI(x, y)
-            if agent.map_tools.is_walkable(tile):
-                depths[tile] = 0
-                depth = get_depth_of_tile(agent, tile, last_found_depth)
-                if not depth in depths:    # Check if the depth has been found before
-                    depths[depth] = []
-                depths[depth].append(tile)
-                last_found_depth = depth   # Update last found depth 
+    ys, xs = np.nonzero(agent.map_grids.walkable)  # In the order of a loop over y and then x
+    for x, y, depth in zip(xs.tolist(), ys.tolist(), depth_map[ys, xs].tolist()):
+        tile = Point2DI(x, y)
+        depths[tile] = 0
+        if not depth in depths:    # Check if the depth has been found before
+            depths[depth] = []
+        depths[depth].append(tile)
 
     return depths
 
-def get_depth_of_tile(agent: BasicAgent, tile: Point2DI, last_found_depth: int) -> int:
-    """ Returns the distance between a walkable tile and its closest wall tile """
-    """current_depth = last_found_depth - 1
-    depth = 0
-    while depth == 0:
-        neighbours = get_neighbours(agent, current_depth, tile)
-        wall_tiles_found = 0
-        wall_threshold = 0
-        for neighbour in neighbours:
-            if not agent.map_tools.is_walkable(neighbour):
-                if wall_tiles_found == 0:
-                    wall_threshold = ((12-current_depth)/28) + 1
-                wall_tiles_found += 1
-                if round(wall_threshold) <= wall_tiles_found:
-                    depth = round(math.log2(current_depth) + 1)
-                    break
-        current_depth += 1
-
-    return depth"""
-    depth = 0
-    current_depth = last_found_depth - 1
-    while depth == 0:
-        offsets = get_neighbours(agent, current_depth, tile)
-        for offset in offsets:
-            if agent.map_tools.is_valid_tile(offset):
-                if not agent.map_tools.is_walkable(offset):
-                    depth = current_depth
-                    break
-        current_depth = current_depth + 1
-    return depth
 
+def get_depth_map(walkable: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Returns the distance between each walkable tile and its closest wall tile, a valid tile that is not walkable, as
+    an int array like walkable. The distance is in square rings of tiles, the chessboard distance, and 0 on walls and
+    on walkable tiles without any wall on the map. Computed as a distance transform, by growing the walls one ring at
+    a time.
+    """
+    height, width = walkable.shape
+    depth_map = np.zeros(walkable.shape, dtype=int)
+    reached = valid & ~walkable
+    depth = 0
+    while reached.any() and not reached[walkable].all():
+        depth += 1
+        grown = reached.copy()
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                grown[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] |= \
+                    reached[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+        depth_map[grown & ~reached] = depth
+        reached = grown
+    return depth_map * walkable
 
 
 def set_gate_clusters(agent: BasicAgent) -> list[set]:
-    """ Beskrivning """
+    """ Returns the gate clusters of flood_gates that are adjacent to a wall, split into connected groups """
+    walkable = agent.map_grids.walkable
+    gates = flood_gates(walkable, get_depth_map(walkable, agent.map_grids.valid))
+    gate_clusters = [{Point2DI(x, y) for x, y in tiles.tolist()} for tiles in gates.values()]
+    return update_gate_clusters(agent, gate_clusters)
+
+
+def flood_gates(walkable: np.ndarray, depth_map: np.ndarray) -> dict[tuple, np.ndarray]:
+    """
+    Priority flood watershed over the depth map, from the deepest tiles down.
+
+    A heap orders the tiles by falling depth and, within a depth, by how many steps they are from the tiles flooded
+    before, in the order they were reached, which is the order set_gate_clusters_legacy labels them in. A tile takes
+    the label of its first labelled neighbour, in get_offset_coords order. The tiles of a depth the flood does not
+    reach start new labels, in (x, y) order. A gate tile has neighbours with more than one label.
+    Returns the gate tiles by the sorted labels they are next to, as (N, 2) arrays of (x, y) in the order they were
+    flooded, the label sets in the order they were first met.
+    """
+    height, width = walkable.shape
+    depth = depth_map.ravel().tolist()
+    free = walkable.ravel().tolist()
+    labels = [0] * (height * width)
+    queued = [False] * (height * width)
+    offsets = get_offset_coords(1)
+    heap = []
+    gates: dict[tuple, list[int]] = {}
+    next_label = 1
+    pushed = 0
+
+    def flood(tile: int, level: int, layer: int, new_basin: bool):
+        nonlocal next_label, pushed
+        y, x = divmod(tile, width)
+        neighbours = [ny * width + nx for dx, dy in offsets
+                      if 0 <= (nx := x + dx) < width and 0 <= (ny := y + dy) < height and free[ny * width + nx]]
+        found = [labels[neighbour] for neighbour in neighbours if labels[neighbour]]
+        if found:
+            if len(adjacent := set(found)) > 1:
+                gates.setdefault(tuple(sorted(adjacent)), []).append(tile)
+            labels[tile] = found[0]
+        else:
+            labels[tile] = next_label
+            next_label += 1
+        for neighbour in neighbours:
+            # The rest of a new basin is labelled in the same pass
+            if not (labels[neighbour] or queued[neighbour] or (new_basin and depth[neighbour] == level)):
+                queued[neighbour] = True
+                heapq.heappush(heap, (-depth[neighbour], layer + 1 if depth[neighbour] == level else 1, pushed,
+                                      neighbour))
+                pushed += 1
+
+    ys, xs = np.nonzero(walkable)
+    tiles = (ys * width + xs)[np.lexsort((ys, xs, -depth_map[ys, xs]))].tolist()
+    i = 0
+    while i < len(tiles):
+        level = depth[tiles[i]]
+        while heap and heap[0][0] == -level:
+            _, layer, _, tile = heapq.heappop(heap)
+            flood(tile, level, layer, False)
+        while i < len(tiles) and depth[tiles[i]] == level:
+            if not labels[tiles[i]]:
+                flood(tiles[i], level, 0, True)
+            i += 1
+
+    return {key: np.array([(tile % width, tile // width) for tile in gate], dtype=int).reshape(-1, 2)
+            for key, gate in gates.items()}
+
+
+def set_gate_clusters_legacy(agent: BasicAgent) -> list[set]:
+    """ The level by level flood flood_gates replaced, kept for benchmark """
 
     depths = set_tile_depths(agent)
     curr_water_level = len(depths)  
@@ -123,7 +254,7 @@ def get_curr_tiles_to_label(agent: BasicAgent, recently_labelled_tiles: dict, la
     for tile in tiles_to_remove:
         neighbours = get_neighbours(agent, 1, tile)
         for neighbour in neighbours:
-            if agent.map_tools.is_walkable(neighbour): 
+            if is_walkable(agent, neighbour): 
                 if neighbour not in labelled_tiles:
                     if neighbour not in curr_tiles_to_label:
                         if neighbour in tiles_to_label:
@@ -135,9 +266,10 @@ def get_curr_tiles_to_label(agent: BasicAgent, recently_labelled_tiles: dict, la
 def update_gate_clusters(agent: BasicAgent, gate_clusters: list) -> list[set]:
     """ Removes all tiles not adjacent to wall """
     upd_gate_clusters = []
+    wall_adjacent = get_depth_map(agent.map_grids.walkable, agent.map_grids.valid) == 1
 
     for gate_cluster in gate_clusters:
-        upd_cluster = {tile for tile in gate_cluster if tile_adj_to_wall(agent, tile)}
+        upd_cluster = {tile for tile in gate_cluster if wall_adjacent[tile.y, tile.x]}
         if len(upd_cluster) >= 1:   # Removes empty sets
             upd_gate_clusters.append(split_cluster(agent, upd_cluster))
 
@@ -222,48 +354,58 @@ def pair_tiles(pairless_gate_tiles: list) -> list[list]:
     return result
 
 
-def build_gate(agent: BasicAgent, gate_pair: list) -> list:
-    """ BFS algorithm that finds a walkable path from a start tile to an end tile """
-    start = gate_pair[0]
-    end = gate_pair[1]
-    queue = [[start]]
-    visited = []
-
-    while queue:
-        path = queue.pop(0)
-        curr_tile = path[-1]
-        if curr_tile not in visited:
-            neighbours = get_neighbours(agent, 1, curr_tile)
-            for neighbour in neighbours:
-                if agent.map_tools.is_walkable(neighbour):
-                    new_path = list(path)
-                    new_path.append(neighbour)
-                    queue.append(new_path)
-                    if neighbour == end:
-                        return refine_bottleneck(agent, new_path)  
-            visited.append(curr_tile)
-    return None
-
-
-def refine_bottleneck(agent: BasicAgent, bottleneck: list) -> list:
-    """ Removes unnecessary tiles from a bottleneck """
-    start_tile = None
-    end_tile = None
-
-    for index in range(len(bottleneck) // 2):
-        curr_start = bottleneck[index]
-        curr_end = bottleneck[-1 - index]
-
-        if curr_start == curr_end:
-            break
-        if tile_adj_to_wall(agent, curr_start):
-            start_tile = curr_start
-        if tile_adj_to_wall(agent, curr_end):
-            end_tile = curr_end
-        
-    refined_bottleneck = bottleneck[bottleneck.index(start_tile):bottleneck.index(end_tile) + 1]
-
-    return refined_bottleneck
+def build_gates(walkable: np.ndarray, gate_pairs: list[tuple[Point2DI, Point2DI]]) -> list[np.ndarray]:
+    """
+    BFS that finds a walkable path from the start tile to the end tile of each pair, as a (N, 2) array of (x, y), None
+    if there is none. Pairs with the same start share one search, run until all of their ends are found. The
+    neighbours are expanded in get_offset_coords order, so the paths are the first ones a BFS in that order finds.
+    """
+    height, width = walkable.shape
+    free = walkable.ravel().tolist()
+    offsets = [(dx, dy, dy * width + dx) for dx, dy in get_offset_coords(1)]
+    ends_by_start: dict[int, list[int]] = {}
+    for start, end in gate_pairs:
+        ends_by_start.setdefault(start.y * width + start.x, []).append(end.y * width + end.x)
+
+    paths: dict[tuple[int, int], np.ndarray] = {}
+    for start, ends in ends_by_start.items():
+        parent = [-2] * (height * width)  # -2 for tiles not reached yet
+        parent[start] = -1
+        remaining = set(ends) - {start}
+        queue = deque([start])
+        while queue and remaining:
+            tile = queue.popleft()
+            y, x = divmod(tile, width)
+            for dx, dy, step in offsets:
+                neighbour = tile + step
+                if (0 <= x + dx < width and 0 <= y + dy < height and free[neighbour]
+                        and parent[neighbour] == -2):
+                    parent[neighbour] = tile
+                    queue.append(neighbour)
+                    remaining.discard(neighbour)
+        for end in ends:
+            if parent[end] == -2:
+                continue
+            path = [end]
+            while parent[path[-1]] >= 0:
+                path.append(parent[path[-1]])
+            paths[(start, end)] = np.array([(tile % width, tile // width) for tile in reversed(path)],
+                                           dtype=np.int32)
+
+    return [paths.get((start.y * width + start.x, end.y * width + end.x)) for start, end in gate_pairs]
+
+
+def refine_bottleneck(wall_adjacent: np.ndarray, bottleneck: np.ndarray) -> np.ndarray:
+    """ Removes unnecessary tiles from a bottleneck, the tiles before the last wall adjacent tile of its first half
+    and after the first wall adjacent tile of its second half """
+    half = len(bottleneck) // 2
+    adjacent = wall_adjacent[bottleneck[:, 1], bottleneck[:, 0]]
+    start_indices = np.flatnonzero(adjacent[:half])
+    end_indices = len(bottleneck) - 1 - np.flatnonzero(adjacent[::-1][:half])
+    start = start_indices[-1] if len(start_indices) else 0
+    end = end_indices[-1] if len(end_indices) else len(bottleneck) - 1
+
+    return bottleneck[start:end + 1]
 
 
 def add_tile_to_gate_cluster(neighbours: dict, tile: Point2DI, gate_clusters: list, region_pairs: list) -> None:
@@ -300,7 +442,7 @@ def get_labelled_neighbours(agent: BasicAgent, labelled_tiles: dict, tile: Point
     neighbours = get_neighbours(agent, 1, tile) # Only the closest neighbors (one square in radius)
     labelled_neighbours = {}
     for neighbour in neighbours:
-        if agent.map_tools.is_walkable(neighbour):
+        if is_walkable(agent, neighbour):
             if neighbour in labelled_tiles: # Is the neighbor labelled? If so, add neighbor to labelled neighbors
                 labelled_neighbours[neighbour] = labelled_tiles[neighbour]
     return labelled_neighbours
@@ -311,20 +453,27 @@ def tile_adj_to_wall(agent: BasicAgent, tile: Point2DI) -> bool:
     neighbours = get_neighbours(agent, 1, tile)
     adj_to_wall = False
     for neighbour in neighbours:
-        if not agent.map_tools.is_walkable(neighbour):
+        if not is_walkable(agent, neighbour):
             adj_to_wall = True
             break
     return adj_to_wall
 
 
+def is_walkable(agent: BasicAgent, tile: Point2DI) -> bool:
+    """ Returns if a valid tile is walkable, from the grid of the agent instead of map_tools """
+    return agent.map_grids.walkable[tile.y, tile.x]
+
+
 def get_neighbours(agent: BasicAgent, current_depth: int, tile: Point2DI) -> list:
     """ Returns a list of all valid neighbours to a tile at a given radius """
     neighbour_coords = []
+    valid = agent.map_grids.valid
     offsets = get_offset_coords(current_depth)
     for offset in offsets:
         neighbour_2d = Point2D(tile.x, tile.y) + Point2D(*offset)
         neighbour_2di = Point2DI(neighbour_2d)
-        if agent.map_tools.is_valid_tile(neighbour_2di):
+        if (0 <= neighbour_2di.x < valid.shape[1] and 0 <= neighbour_2di.y < valid.shape[0]
+                and valid[neighbour_2di.y, neighbour_2di.x]):
             neighbour_coords.append(neighbour_2di)
 
     return neighbour_coords
@@ -341,21 +490,43 @@ def get_offset_coords(radius: int) -> list[tuple]:
     return offset_coordinates
 
 
-def sort_bottlenecks(agent: BasicAgent, bottlenecks: list[list], start_base_pos: Point2DI) -> list[list]:
-        """ Fetches bottlenecks and sorts them by closest to startbase position of agent """
+def sort_bottlenecks(agent: BasicAgent, bottlenecks: list[np.ndarray], start_base_pos: Point2DI) -> list[np.ndarray]:
+        """ Sorts the bottlenecks by the distance from their first tile to the startbase position of agent, closest
+        first """
+        if not bottlenecks:
+            return []
 
         # Get one tile from each bottleneck
-        selected_tiles = [bottleneck[0] for bottleneck in bottlenecks]
-        
-        # Get the distance to each bottleneck and its list index
-        distances = [ 
-            (distance_between_tiles(start_base_pos, tile), i)
-            for i, tile in enumerate(selected_tiles) 
-        ]
-        # Sort the list by distance, where the closest one is first
-        sorted_distances = sorted(distances, key=lambda x: x[0])
-
-        # Add the bottleneck to nearest by its list index
-        nearest_bottles = [bottlenecks[i] for _, i in sorted_distances]
-
-        return nearest_bottles
+        selected_tiles = np.array([bottleneck[0] for bottleneck in bottlenecks], dtype=float)
+
+        # Get the distance to each bottleneck, and the list indices sorted by it, where the closest one is first
+        distances = np.hypot(selected_tiles[:, 0] - start_base_pos.x, selected_tiles[:, 1] - start_base_pos.y)
+        nearest = np.argsort(distances, kind="stable")
+
+        return [bottlenecks[i] for i in nearest.tolist()]
+
+
+def benchmark(walkable: np.ndarray, repeat: int = 1) -> dict:
+    """
+    Times set_gate_clusters against set_gate_clusters_legacy on a walkability grid, like the walkable.npy of a map
+    bundle, and checks that they find the same gate clusters
+    """
+    agent = SimpleNamespace(map_grids=SimpleNamespace(walkable=walkable, valid=np.ones_like(walkable)))
+    times = {}
+    results = {}
+    for name, function in (("flood", set_gate_clusters), ("legacy", set_gate_clusters_legacy)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results[name] = function(agent)
+        times[name] = (time.perf_counter() - start) / repeat
+
+    def as_tuples(gate_clusters):
+        return [sorted(sorted((tile.x, tile.y) for tile in group) for group in cluster) for cluster in gate_clusters]
+    return dict(flood_s=times["flood"], legacy_s=times["legacy"], clusters=len(results["flood"]),
+                same=as_tuples(results["flood"]) == as_tuples(results["legacy"]))
+
+
+if __name__ == "__main__":
+    row = benchmark(np.load(sys.argv[1]))
+    print(f"flood {row['flood_s']:.3f} s, legacy {row['legacy_s']:.3f} s, {row['clusters']} clusters, "
+          f"same: {row['same']}")
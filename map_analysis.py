@@ -0,0 +1,252 @@
+"""
+Offline generation of regions.json and chokepoints.json for a map, in its data directory data/<map name>/ (see
+map_bundle.map_data_dir), which the bot reads when it plays the map.
+
+The map is given as grids exported once from a running bot with BasicAgent.export_map_grids set, see export_grids:
+the walkable tiles and optionally the terrain height, as .npy files indexed [y, x] in the data directory of the map.
+
+The analysis is a watershed of the distance to the nearest wall. distance_transform gives every walkable tile its
+Euclidean distance to the closest non-walkable tile, the depth. segment then floods the tiles from the deepest down,
+growing a basin from every local maximum and joining basins where they meet, except where they meet at a saddle
+much shallower than both, which is a chokepoint. The tiles where two regions meet become the chokepoint, a line
+from wall to wall across the passage, and are left out of both regions like in the existing data.
+
+Usage:
+    python map_analysis.py data/<map name>/walkable.npy [--height data/<map name>/height.npy] [--output directory]
+The json files are written next to walkable.npy unless another output directory is given.
+Only NumPy is needed, so it runs without the game and the library bindings.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from agents.basic_agent import BasicAgent
+
+MIN_REGION_DEPTH = 3.0  # Basins whose deepest tile is closer to a wall than this are never kept apart
+MIN_REGION_AREA = 64  # Smaller regions are dropped, their tiles go to the closest region at runtime
+CHOKE_RATIO = 0.75  # Basins meeting at a depth below this share of the shallower one's depth stay apart
+MAX_CHOKE_DEPTH = 8.0  # Basins meeting at a deeper saddle, a passage over about twice as wide, always join
+HEIGHT_STEP = 1.0  # Largest terrain height difference between neighbouring tiles of the same region
+DISTANCE_CHUNK_SIZE = 64  # Rows per step of the second pass of distance_transform
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+class MapAnalysis(NamedTuple):
+    labels: np.ndarray  # int16 (height, width), region id per tile, 0 on chokepoints and non-region tiles
+    centers: list[tuple[int, int]]  # Deepest tile of each region, in the order of the ids
+    chokepoints: list[np.ndarray]  # (T, 2) x and y of the tiles of each chokepoint
+    depth: np.ndarray  # Distance to the nearest wall, see distance_transform
+
+
+def distance_transform(walkable: np.ndarray) -> np.ndarray:
+    """
+    Returns the Euclidean distance from every tile to the center of the closest non-walkable tile, outside of the
+    map counting as non-walkable, as a float (height, width) array. Non-walkable tiles get 0.
+    Exact, done as a distance along the columns followed by a minimum over the rows.
+    """
+    height, width = walkable.shape
+    inf = height + width
+    column = np.where(walkable, inf, 0).astype(np.int64)
+    column[0] = np.minimum(column[0], 1)  # The row above the map is a wall
+    for y in range(1, height):
+        column[y] = np.minimum(column[y], column[y - 1] + 1)
+    column[-1] = np.minimum(column[-1], 1)
+    for y in range(height - 2, -1, -1):
+        column[y] = np.minimum(column[y], column[y + 1] + 1)
+
+    # Walls outside of the left and right edges, at x = -1 and x = width
+    xs = np.arange(-1, width + 1)
+    column = np.pad(column, ((0, 0), (1, 1)))
+    offsets = (np.arange(width)[:, None] - xs[None, :]) ** 2  # (width, width + 2)
+    squared = np.zeros((height, width))
+    for start in range(0, height, DISTANCE_CHUNK_SIZE):
+        g = column[start:start + DISTANCE_CHUNK_SIZE, None, :] ** 2  # (rows, 1, width + 2)
+        squared[start:start + DISTANCE_CHUNK_SIZE] = (offsets[None] + g).min(axis=2)
+    return np.where(walkable, np.sqrt(squared), 0)
+
+
+def segment(walkable: np.ndarray, depth: np.ndarray, terrain_height: np.ndarray = None,
+            min_depth: float = MIN_REGION_DEPTH, choke_ratio: float = CHOKE_RATIO,
+            max_choke_depth: float = MAX_CHOKE_DEPTH, height_step: float = HEIGHT_STEP) -> np.ndarray:
+    """
+    Floods the walkable tiles from the deepest down with a union-find over basins. A tile joins the deepest basin
+    among its processed neighbours, and the other basins are merged into that one unless both are deeper than
+    min_depth and the tile, the saddle between them, is shallower than both max_choke_depth and choke_ratio times
+    the shallower of them.
+    Neighbours differing more than height_step in terrain height are not connected.
+    Returns the basin of every tile as an index into the flattened map, -1 on non-walkable tiles.
+    """
+    height, width = walkable.shape
+    flat_depth = depth.ravel().tolist()
+    flat_height = terrain_height.ravel().tolist() if terrain_height is not None else None
+    tiles = np.flatnonzero(walkable.ravel())
+    order = tiles[np.argsort(-depth.ravel()[tiles], kind="stable")].tolist()
+
+    parent = {}
+    basin_depth = {}
+
+    def find(tile):
+        root = tile
+        while parent[root] != root:
+            root = parent[root]
+        while parent[tile] != root:
+            parent[tile], tile = root, parent[tile]
+        return root
+
+    for tile in order:
+        y, x = divmod(tile, width)
+        roots = set()
+        for dx, dy in NEIGHBOURS:
+            nx, ny = x + dx, y + dy
+            neighbour = ny * width + nx
+            if 0 <= nx < width and 0 <= ny < height and neighbour in parent and (
+                    flat_height is None or abs(flat_height[neighbour] - flat_height[tile]) <= height_step):
+                roots.add(find(neighbour))
+        if not roots:
+            parent[tile] = tile
+            basin_depth[tile] = flat_depth[tile]
+            continue
+        deepest = max(roots, key=lambda root: (basin_depth[root], -root))
+        parent[tile] = deepest
+        for root in roots - {deepest}:
+            shallower = min(basin_depth[root], basin_depth[deepest])
+            if shallower >= min_depth and flat_depth[tile] < min(choke_ratio * shallower, max_choke_depth):
+                continue    # A chokepoint, the basins stay apart
+            parent[root] = deepest
+
+    basins = np.full(height * width, -1, dtype=np.int64)
+    for tile in order:
+        basins[tile] = find(tile)
+    return basins.reshape(height, width)
+
+
+def region_labels(basins: np.ndarray, depth: np.ndarray, min_area: int = MIN_REGION_AREA):
+    """
+    Numbers the basins with at least min_area tiles from 1, deepest first.
+    Returns the int16 labels, 0 elsewhere, and the deepest tile of each region as (x, y).
+    """
+    width = basins.shape[1]
+    roots, counts = np.unique(basins[basins >= 0], return_counts=True)
+    roots = roots[counts >= min_area]
+    # The root of a basin is the first tile flooded in it, its deepest
+    roots = roots[np.argsort(-depth.ravel()[roots], kind="stable")]
+    lookup = np.zeros(basins.size + 1, dtype=np.int16)
+    lookup[roots + 1] = np.arange(1, len(roots) + 1)
+    labels = lookup[basins + 1]
+    centers = [(int(root % width), int(root // width)) for root in roots]
+    return labels, centers
+
+
+def chokepoint_tiles(labels: np.ndarray) -> list[np.ndarray]:
+    """
+    Returns the chokepoints between the regions, the tiles of the lower numbered region that have a side on
+    another region, split into 8-connected lines per pair of regions. The tiles are removed from labels.
+    """
+    height, width = labels.shape
+    padded = np.pad(labels, 1)
+    other = np.zeros(labels.shape, dtype=np.int16)
+    for dx, dy in NEIGHBOURS:
+        neighbour = padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+        meets = (labels > 0) & (neighbour > labels) & (other == 0)
+        other[meets] = neighbour[meets]
+
+    chokepoints = []
+    ys, xs = np.nonzero(other)
+    remaining = {(int(x), int(y)): (int(labels[y, x]), int(other[y, x])) for x, y in zip(xs, ys)}
+    for start in sorted(remaining):
+        if start not in remaining:
+            continue
+        pair = remaining.pop(start)
+        line = [start]
+        stack = [start]
+        while stack:
+            x, y = stack.pop()
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    tile = (x + dx, y + dy)
+                    if remaining.get(tile) == pair:
+                        del remaining[tile]
+                        line.append(tile)
+                        stack.append(tile)
+        chokepoints.append(np.array(sorted(line), dtype=int))
+
+    labels[ys, xs] = 0
+    return chokepoints
+
+
+def analyze(walkable: np.ndarray, terrain_height: np.ndarray = None) -> MapAnalysis:
+    """Splits the walkable tiles of a map into regions and the chokepoints between them"""
+    walkable = np.asarray(walkable, dtype=bool)
+    depth = distance_transform(walkable)
+    basins = segment(walkable, depth, terrain_height)
+    labels, centers = region_labels(basins, depth)
+    chokepoints = chokepoint_tiles(labels)
+    return MapAnalysis(labels, centers, chokepoints, depth)
+
+
+def regions_json(analysis: MapAnalysis) -> list[dict]:
+    """The regions in the schema of regions.json"""
+    regions = []
+    for region_id, (x, y) in enumerate(analysis.centers, 1):
+        ys, xs = np.nonzero(analysis.labels == region_id)
+        regions.append({
+            "tiles": [{"x": int(tx), "y": int(ty)} for tx, ty in zip(xs, ys)],
+            "center": {"x": x, "y": y},
+        })
+    return regions
+
+
+def chokepoints_json(analysis: MapAnalysis) -> list[dict]:
+    """The chokepoints in the schema of chokepoints.json, centered on their tile closest to their mean"""
+    chokepoints = []
+    for tiles in analysis.chokepoints:
+        center = tiles[np.argmin(np.hypot(*(tiles - tiles.mean(axis=0)).T))]
+        chokepoints.append({
+            "tiles": [{"x": float(x), "y": float(y)} for x, y in tiles],
+            "center": {"x": float(center[0]), "y": float(center[1])},
+        })
+    return chokepoints
+
+
+def write_json(analysis: MapAnalysis, directory: str):
+    """Writes regions.json and chokepoints.json to the directory"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "regions.json"), "w") as file:
+        json.dump(regions_json(analysis), file)
+    with open(os.path.join(directory, "chokepoints.json"), "w") as file:
+        json.dump(chokepoints_json(analysis), file)
+
+
+def export_grids(agent: BasicAgent, directory: str):
+    """
+    Writes the walkable tiles and the terrain height of the agent's map as walkable.npy and height.npy, done at game
+    start when BasicAgent.export_map_grids is set
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "walkable.npy"), np.asarray(agent.map_grids.walkable))
+    np.save(os.path.join(directory, "height.npy"), np.asarray(agent.map_grids.terrain_height))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates regions.json and chokepoints.json for a map")
+    parser.add_argument("walkable", help=".npy bool grid of the walkable tiles, indexed [y, x]")
+    parser.add_argument("--height", help=".npy grid of the terrain height, indexed [y, x]")
+    parser.add_argument("--output", help="directory to write the json files to, by default the one of walkable")
+    args = parser.parse_args(argv)
+    output = args.output if args.output is not None else os.path.dirname(os.path.abspath(args.walkable))
+
+    start = time.perf_counter()
+    analysis = analyze(np.load(args.walkable), np.load(args.height) if args.height else None)
+    write_json(analysis, output)
+    print(f"{len(analysis.centers)} regions and {len(analysis.chokepoints)} chokepoints written to {output} "
+          f"in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
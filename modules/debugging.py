@@ -66,7 +66,7 @@ def debug_regions(agent: BasicAgent) -> None:
     for y in range(agent.map_tools.height):
         for x in range(agent.map_tools.width):
             tile = Point2DI(x, y)
-            if agent.map_tools.is_walkable(x, y) or tile in agent.region_manager.terrain_borders:
+            if agent.map_grids.walkable[y, x] or tile in agent.region_manager.terrain_borders:
                 if reg := agent.region_manager.get_exact_region(tile):
                     color = reg.id
                 else:
@@ -89,9 +89,9 @@ def debug_terrain(agent: BasicAgent) -> None:
     tmap = {}
     for y in range(agent.map_tools.height):
         for x in range(agent.map_tools.width):
-            if agent.map_tools.is_walkable(x, y):
+            if agent.map_grids.walkable[y, x]:
                 for neighbour in get_neighbours2(agent, x, y).values():
-                    if not agent.map_tools.is_walkable(neighbour[0], neighbour[1]):
+                    if not agent.map_grids.walkable[neighbour[1], neighbour[0]]:
                         tmap[neighbour] = 1
     agent.debugger.set_display_values(tmap, (agent.map_tools.width, agent.map_tools.height))
 
@@ -104,9 +104,9 @@ def path_debug(agent: BasicAgent) -> dict:
     for y in range(agent.map_tools.height):
         heat_map_row = []
         for x in range(agent.map_tools.width):
-            if agent.map_tools.is_walkable(x, y):
+            if agent.map_grids.walkable[y, x]:
                 for neighbour in get_neighbours2(agent, x, y).values():
-                    if not agent.map_tools.is_walkable(neighbour[0], neighbour[1]):
+                    if not agent.map_grids.walkable[neighbour[1], neighbour[0]]:
                         tmap[neighbour] = 1
     agent.debugger.set_display_values(tmap, (agent.map_tools.width, agent.map_tools.height))
 
@@ -114,7 +114,7 @@ def path_debug(agent: BasicAgent) -> dict:
 def path_debug(agent: BasicAgent) -> dict:
     """Displays the map in a separate window."""
     return {
-        (x, y): int(agent.map_tools.is_walkable(x, y))
+        (x, y): int(agent.map_grids.walkable[y, x])
         for x in range(agent.map_tools.width)
         for y in range(agent.map_tools.height)
     }
@@ -130,7 +130,7 @@ def debug_map(agent: BasicAgent) -> None:
     for y in range(agent.map_tools.height):
         heat_map_row = []
         for x in range(agent.map_tools.width):
-            if int(agent.map_tools.is_walkable(x, y)):
+            if int(agent.map_grids.walkable[y, x]):
                 b = False
                 #b = print_depth(bottle_tiles, heat_map_row, x, y) # Avkommentera denna rad om du vill ha ursprungsfunktionaliteten (Används av eriei013)
                 #b = print_gate_tiles(bottle_tiles, heat_map_row, x, y) # Avkommentera denna rad om du vill ha ursprungsfunktionaliteten (Används av eriei013)
@@ -146,10 +146,7 @@ def debug_map(agent: BasicAgent) -> None:
 
 def heat_map_debug(agent: BasicAgent) -> None:
     """Displays the map in a separate window."""
-    heat_map = [
-        [int(agent.map_tools.is_walkable(x, y)) for x in range(agent.map_tools.width)]
-        for y in range(agent.map_tools.height)
-    ]
+    heat_map = agent.map_grids.walkable.astype(int).tolist()
     agent.debugger.set_display_values(heat_map)
 
 
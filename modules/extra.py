@@ -22,12 +22,13 @@ from __future__ import annotations
 from functools import cache
 import json
 from math import sqrt, atan2, pi
-from typing import TYPE_CHECKING, Iterable, Optional, Union
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional, Union
 
 if TYPE_CHECKING:
     from py_unit import PyUnit
     from agents.basic_agent import BasicAgent
 
+import numpy as np
 import tasks
 from functools import singledispatch
 from library import UnitType, PLAYER_SELF, Point2D, UPGRADE_ID, Point2DI, UNIT_TYPEID, \
@@ -211,6 +212,20 @@ def _(pos: tuple, agent: BasicAgent) -> list[tuple]:
     return set(map(lambda pos: (pos.x, pos.y), get_adjacent_neighbours(Point2DI(pos[0], pos[1]), agent)))
 
 
+def tile_grid(map_tools, query: Callable[[int, int], Any], dtype=bool) -> np.ndarray:
+    """Returns query(x, y) for every tile of the map as a (height, width) array indexed [y, x]"""
+    grid = np.zeros((map_tools.height, map_tools.width), dtype=dtype)
+    for y in range(map_tools.height):
+        for x in range(map_tools.width):
+            grid[y, x] = query(x, y)
+    return grid
+
+
+def walkable_grid(map_tools) -> np.ndarray:
+    """Returns the walkable tiles of the map as a bool (height, width) array indexed [y, x]"""
+    return tile_grid(map_tools, map_tools.is_walkable)
+
+
 def get_units_in_radius(agent: BasicAgent,
                         position: Point2D,
                         radius: int,
@@ -247,12 +262,6 @@ def get_closest(items: Iterable, cmp_pos: Point2D, access=lambda pos: pos):
     return min(items, key=lambda pos: cmp_pos.square_distance(access(pos)))
 
 
-@cache
-@get_closest.register
-def _(items: frozenset, cmp_pos: Point2D, access=lambda pos: pos):  # maybe just Hashable
-    return min(items, key=lambda pos: cmp_pos.square_distance(access(pos)))
-
-
 def get_approx_distance(self, position):
     max_val = abs(self.x - position.x)
     min_val = abs(self.y - position.y)
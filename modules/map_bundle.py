@@ -0,0 +1,122 @@
+"""
+Precompiled per map data, stored as .npy files that are memory mapped when loaded.
+
+The static analysis of a map, the walkability grid, the region rasters, borders, bottlenecks and the potential
+atlas, is the same every time the bot plays that map. MapBundle stores each of these arrays once in
+data/compiled/<key>/, where key is a hash of the map file and the data files the analysis reads, the regions and
+chokepoints in map_data_dir, and later launches load them with mmap_mode="r". Bot processes playing the same map on
+one machine then share the pages of the files instead of each building its own copy.
+
+An array is only computed when its file is missing. Files are written to a temporary name and renamed, so processes
+compiling the same map at once never see a partial file.
+"""
+from __future__ import annotations
+import hashlib
+import os
+from typing import Callable, Sequence
+
+import numpy as np
+
+DATA_DIR = "data"
+COMPILED_DIR = os.path.join(DATA_DIR, "compiled")
+BUNDLE_VERSION = 1  # Bump when the content of an array changes, so old bundles are not reused
+SOURCE_NAMES = ("regions.json", "chokepoints.json")  # Read by the analysis besides the map itself
+
+
+def map_data_dir(map_path: str) -> str:
+    """Directory of the data of a map, data/<name of the map file>/, written by map_analysis or by hand"""
+    return os.path.join(DATA_DIR, os.path.splitext(os.path.basename(map_path))[0])
+
+
+def source_files(map_path: str) -> tuple[str, ...]:
+    """The files of SOURCE_NAMES of a map"""
+    return tuple(os.path.join(map_data_dir(map_path), name) for name in SOURCE_NAMES)
+
+
+def map_key(map_path: str, files: Sequence[str] = None) -> str:
+    """
+    Returns the sha1 of the map file, the files, by default the source files of the map, and BUNDLE_VERSION.
+    Missing files count as missing, so a map can be played to export its grids before map_analysis wrote its data.
+    """
+    digest = hashlib.sha1(f"bundle {BUNDLE_VERSION}".encode())
+    for path in (map_path, *(files if files is not None else source_files(map_path))):
+        if not os.path.exists(path):
+            digest.update(f"missing {os.path.basename(path)}".encode())
+            continue
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MapBundle:
+    """Directory of named arrays compiled for one map"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_map(cls, map_path: str, compiled_dir: str = COMPILED_DIR) -> MapBundle:
+        return cls(os.path.join(compiled_dir, map_key(map_path)))
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def __contains__(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    def load(self, name: str) -> np.ndarray:
+        """Returns the stored array memory mapped read only"""
+        return np.load(self.path(name), mmap_mode="r")
+
+    def save(self, name: str, array: np.ndarray):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{self.path(name)}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, np.ascontiguousarray(array))
+        os.replace(temporary, self.path(name))
+
+    def get(self, name: str, build: Callable[[], np.ndarray]) -> np.ndarray:
+        """Returns the stored array, building and storing it first if it is missing"""
+        return self.get_many((name,), lambda: (build(),))[0]
+
+    def get_many(self, names: Sequence[str], build: Callable[[], Sequence[np.ndarray]]) -> tuple[np.ndarray, ...]:
+        """Like get for arrays that are built together, they are all rebuilt if any of them is missing"""
+        if all(name in self for name in names):
+            self.hits += 1
+        else:
+            self.misses += 1
+            for name, array in zip(names, build()):
+                self.save(name, array)
+        return tuple(self.load(name) for name in names)
+
+    def get_ragged(self, name: str, build: Callable[[], list[np.ndarray]]) -> list[np.ndarray]:
+        """Like get for a list of arrays of different lengths, see pack_ragged"""
+        values, offsets = self.get_many((name, f"{name}_offsets"), lambda: pack_ragged(build()))
+        return unpack_ragged(values, offsets)
+
+
+def load_or_build(bundle: MapBundle | None, name: str, build: Callable[[], np.ndarray]) -> np.ndarray:
+    """MapBundle.get when there is a bundle, otherwise just build"""
+    return bundle.get(name, build) if bundle is not None else build()
+
+
+def load_or_build_many(bundle: MapBundle | None, names: Sequence[str],
+                       build: Callable[[], Sequence[np.ndarray]]) -> tuple[np.ndarray, ...]:
+    """MapBundle.get_many when there is a bundle, otherwise just build"""
+    return bundle.get_many(names, build) if bundle is not None else tuple(build())
+
+
+def pack_ragged(arrays: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Concatenates arrays along their first axis, returns the result and the offset of each array plus the end"""
+    lengths = [len(array) for array in arrays]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    values = np.concatenate(arrays) if arrays else np.zeros((0,))
+    return values, offsets
+
+
+def unpack_ragged(values: np.ndarray, offsets: np.ndarray) -> list[np.ndarray]:
+    """The arrays pack_ragged packed, as views of values"""
+    return [values[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
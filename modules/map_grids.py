@@ -0,0 +1,135 @@
+"""
+Snapshot of the tile grids of the map, so map analysis reads arrays instead of calling map_tools once per tile.
+
+walkable, buildable, terrain_height and valid are captured once through map_tools, or loaded from the map bundle, and
+do not change during a game. pathable starts as walkable and follows the buildings: update adds the footprint of every
+building that appears and removes it when the building is gone or, for a supply depot, lowered. Each change bumps
+version and is recorded in changes, so users of pathable can catch up incrementally with changes_since.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterable
+
+import numpy as np
+from library import PLAYER_SELF, UNIT_TYPEID
+
+from modules.extra import tile_grid
+from modules.map_bundle import load_or_build_many
+
+if TYPE_CHECKING:
+    from agents.basic_agent import BasicAgent
+    from modules.py_unit import PyUnit
+
+GRID_NAMES = ("walkable", "buildable", "terrain_height", "valid")
+LOWERED_TYPES = frozenset({UNIT_TYPEID.TERRAN_SUPPLYDEPOTLOWERED})  # Buildings that units can walk over
+
+Footprint = tuple[int, int, int, int]  # x and y of the lowest tile, width and height in tiles
+
+
+def capture_grids(map_tools) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the grids of GRID_NAMES, queried from map_tools"""
+    return (tile_grid(map_tools, map_tools.is_walkable),
+            tile_grid(map_tools, map_tools.is_buildable),
+            tile_grid(map_tools, map_tools.terrain_height, np.float32),
+            tile_grid(map_tools, map_tools.is_valid_tile))
+
+
+def footprint(py_unit: PyUnit) -> Footprint | None:
+    """Returns the tiles the unit blocks, None if it does not block ground units"""
+    unit_type = py_unit.unit_type
+    if (not (unit_type.is_building or unit_type.is_mineral or unit_type.is_geyser) or py_unit.is_flying
+            or unit_type.unit_typeid in LOWERED_TYPES):
+        return None
+    width, height = unit_type.tile_width, unit_type.tile_height
+    position = py_unit.position
+    return int(round(position.x - width / 2)), int(round(position.y - height / 2)), width, height
+
+
+class MapGrids:
+
+    def __init__(self, agent: BasicAgent):
+        self.agent = agent
+        self.walkable, self.buildable, self.terrain_height, self.valid = load_or_build_many(
+            agent.map_bundle, GRID_NAMES, lambda: capture_grids(agent.map_tools))
+        # walkable plus the tiles of start structures, like minerals, that are gone
+        self.open = np.array(self.walkable)
+        self.blockers = np.zeros(self.walkable.shape, dtype=np.int16)  # Number of footprints on each tile
+        self.pathable = np.array(self.walkable)
+        self.buildings: dict[Footprint, PyUnit] = {}
+        self.start_structures: set[Footprint] = set()  # Footprints already unwalkable in walkable
+        self.version = 0
+        self.changes: list[Footprint] = []  # changes[i] is the footprint that changed in version i + 1
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.walkable.shape
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.shape[1] and 0 <= y < self.shape[0]
+
+    def is_walkable(self, pos) -> bool:
+        x, y = int(pos.x), int(pos.y)
+        return self.in_bounds(x, y) and bool(self.walkable[y, x])
+
+    def is_pathable(self, pos) -> bool:
+        """Like is_walkable, but false under the buildings"""
+        x, y = int(pos.x), int(pos.y)
+        return self.in_bounds(x, y) and bool(self.pathable[y, x])
+
+    def tiles(self, rect: Footprint) -> tuple[slice, slice]:
+        """The index of the footprint in the grids"""
+        x, y, width, height = rect
+        return slice(max(y, 0), max(y + height, 0)), slice(max(x, 0), max(x + width, 0))
+
+    def update(self, py_units: Iterable[PyUnit]):
+        """
+        Brings pathable up to date with the buildings among the units. A footprint that is no longer among them is
+        removed if the building was ours, died or its center is visible, enemy buildings out of sight are kept.
+        """
+        current: dict[Footprint, PyUnit] = {}
+        for py_unit in py_units:
+            if (rect := footprint(py_unit)) is not None:
+                current[rect] = py_unit
+
+        map_tools = self.agent.map_tools
+        gone = [rect for rect, py_unit in self.buildings.items()
+                if rect not in current and (py_unit.player == PLAYER_SELF or not py_unit.is_alive
+                                            or map_tools.is_visible(rect[0] + rect[2] // 2, rect[1] + rect[3] // 2))]
+        for rect in gone:
+            self.remove(rect)
+        for rect, py_unit in current.items():
+            if rect in self.buildings:
+                self.buildings[rect] = py_unit  # Enemy units get a new id when they come back into vision
+            else:
+                self.add(rect, py_unit)
+
+    def add(self, rect: Footprint, py_unit: PyUnit):
+        tiles = self.tiles(rect)
+        self.buildings[rect] = py_unit
+        if not self.walkable[tiles].any():
+            self.start_structures.add(rect)
+        self.blockers[tiles] += 1
+        self.pathable[tiles] = False
+        self.changed(rect)
+
+    def remove(self, rect: Footprint):
+        tiles = self.tiles(rect)
+        del self.buildings[rect]
+        if rect in self.start_structures:
+            self.start_structures.remove(rect)
+            self.open[tiles] = self.valid[tiles]
+        self.blockers[tiles] -= 1
+        self.pathable[tiles] = self.open[tiles] & (self.blockers[tiles] == 0)
+        self.changed(rect)
+
+    def changed(self, rect: Footprint):
+        self.version += 1
+        self.changes.append(rect)
+
+    def changes_since(self, version: int) -> list[Footprint]:
+        """The footprints that changed after the version, oldest first"""
+        return self.changes[version:]
+
+    def tiles_changed_since(self, version: int) -> set[tuple[int, int]]:
+        """The (x, y) tiles of the footprints that changed after the version"""
+        return {(tx, ty) for x, y, width, height in self.changes_since(version)
+                for tx in range(x, x + width) for ty in range(y, y + height)}
@@ -0,0 +1,114 @@
+"""
+Flow fields for many units heading to the same target.
+
+A FlowField holds the ground distance from the target to every pathable tile, the integration field, and the tile to
+step to from every tile, the neighbour it is closest to the target through. Once it is computed, the next waypoint of
+any unit is an array read, so the cost of moving units grows with the number of targets rather than the number of
+units.
+
+The integration field is an IntegrationField, which repairs only the part of the field that new or removed
+buildings affect when map_grids changes.
+
+FlowFields keeps the flow fields of the last FLOW_FIELD_CACHE_SIZE targets in an LRU cache and brings a field up to
+date with map_grids when it is read.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+from library import Point2D
+
+from modules.path_finding.grid_search import DIAGONAL, STRAIGHT, UNREACHABLE
+from modules.path_finding.lpa_star import NEIGHBOURS, IntegrationField, Tile
+
+if TYPE_CHECKING:
+    from agents.basic_agent import BasicAgent
+
+FLOW_FIELD_CACHE_SIZE = 4
+WAYPOINT_TILES = 4  # Tiles down the flow of the waypoint a unit is sent to
+
+
+class FlowField(NamedTuple):
+    integration: IntegrationField
+    next_tile: np.ndarray  # int32 (height, width), y * width + x of the tile to step to, -1 at the target and off paths
+    version: int  # Version of map_grids the field is up to date with
+
+
+def next_tiles(pathable: np.ndarray, field: np.ndarray) -> np.ndarray:
+    """
+    Returns the tile to step to from every tile of the field, as y * width + x, the neighbour with the smallest
+    distance plus step cost that is closer to the target, with the corner rule of distance_field. -1 where none is.
+    """
+    height, width = field.shape
+    padded = np.pad(field, 1, constant_values=UNREACHABLE)
+    free = np.pad(pathable, 1)
+    best = np.full(field.shape, UNREACHABLE, dtype=np.float32)
+    next_tile = np.full(field.shape, -1, dtype=np.int32)
+    tiles = np.arange(height * width, dtype=np.int32).reshape(height, width)
+    for dx, dy in NEIGHBOURS:
+        neighbour = padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+        if dx and dy:
+            step = neighbour + np.float32(DIAGONAL / STRAIGHT)
+            step[~(free[1:1 + height, 1 + dx:1 + dx + width] & free[1 + dy:1 + dy + height, 1:1 + width])] = \
+                UNREACHABLE
+        else:
+            step = neighbour + np.float32(1)
+        better = (step < best) & (neighbour < field)
+        best[better] = step[better]
+        next_tile[better] = tiles[better] + dy * width + dx
+    return next_tile
+
+
+class FlowFields:
+
+    def __init__(self, agent: BasicAgent):
+        self.agent = agent
+        self.cache: OrderedDict[Tile, FlowField] = OrderedDict()
+
+    def pathable(self, target: Tile) -> np.ndarray:
+        """The pathable tiles, with the target among them so that units can flow to a target under a building"""
+        pathable = np.array(self.agent.map_grids.pathable)
+        pathable[target[1], target[0]] = True
+        return pathable
+
+    def get(self, target: Point2D) -> FlowField:
+        """The flow field of the target, computed if it is not cached and repaired if map_grids changed since"""
+        map_grids = self.agent.map_grids
+        tile = (int(target.x), int(target.y))
+        flow_field = self.cache.get(tile)
+        if flow_field is None:
+            pathable = self.pathable(tile)
+            integration = IntegrationField(pathable, tile)
+            flow_field = FlowField(integration, next_tiles(pathable, integration.field()), map_grids.version)
+            self.cache[tile] = flow_field
+            if len(self.cache) > FLOW_FIELD_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        elif flow_field.version != map_grids.version:
+            pathable = self.pathable(tile)
+            integration = flow_field.integration
+            integration.repair(pathable, map_grids.tiles_changed_since(flow_field.version) - {tile})
+            flow_field = self.cache[tile] = FlowField(integration, next_tiles(pathable, integration.field()),
+                                                      map_grids.version)
+        self.cache.move_to_end(tile)
+        return flow_field
+
+    def next_waypoint(self, position: Point2D, target: Point2D, tiles: int = 1) -> Point2D | None:
+        """
+        Center of the tile the given number of tiles down the flow from the position, or of the target tile when the
+        flow reaches it sooner. None at the target or if it cannot be reached.
+        """
+        x, y = int(position.x), int(position.y)
+        map_grids = self.agent.map_grids
+        if not map_grids.in_bounds(x, y):
+            return None
+        next_tile = self.get(target).next_tile
+        tile = int(next_tile[y, x])
+        if tile < 0:
+            return None
+        for _ in range(tiles - 1):
+            if next_tile.flat[tile] < 0:
+                break
+            tile = int(next_tile.flat[tile])
+        next_y, next_x = divmod(tile, map_grids.shape[1])
+        return Point2D(next_x + 0.5, next_y + 0.5)
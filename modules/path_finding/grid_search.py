@@ -0,0 +1,74 @@
+"""
+Ground distances over the walkability grid.
+
+distance_field runs Dial's algorithm, Dijkstra with a bucket queue, from one or more source tiles over the 8-connected
+walkable tiles. Straight steps cost STRAIGHT and diagonal ones DIAGONAL, integers close to 1 and sqrt(2) times ten,
+so every bucket holds the tiles at one distance and no heap is needed. A diagonal step is only allowed when both
+tiles beside it are walkable, units cannot cut a corner.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+STRAIGHT = 10
+DIAGONAL = 14
+UNREACHABLE = np.inf
+
+
+def distance_field(walkable: np.ndarray, sources) -> np.ndarray:
+    """
+    Returns the octile ground distance in tiles from the closest of the (x, y) source tiles to every tile, as a
+    float32 array like walkable, UNREACHABLE where no walkable path leads. A source does not need to be walkable.
+    """
+    height, width = walkable.shape
+    size = height * width
+    free = walkable.ravel().tolist()
+    cost = [-1] * size
+    buckets = [[] for _ in range(DIAGONAL + 1)]
+    for x, y in sources:
+        x, y = int(x), int(y)
+        if 0 <= x < width and 0 <= y < height:
+            cost[y * width + x] = 0
+            buckets[0].append(y * width + x)
+
+    straight = ((1, 0), (-1, 0), (0, 1), (0, -1))
+    diagonal = ((1, 1), (-1, 1), (1, -1), (-1, -1))
+    distance = 0
+    pending = sum(len(bucket) for bucket in buckets)
+    while pending:
+        bucket = buckets[distance % (DIAGONAL + 1)]
+        while bucket:
+            tile = bucket.pop()
+            pending -= 1
+            if cost[tile] != distance:
+                continue    # Reached cheaper after it was queued
+            y, x = divmod(tile, width)
+            for dx, dy in straight:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < width and 0 <= ny < height:
+                    neighbour = tile + dy * width + dx
+                    if free[neighbour] and not 0 <= cost[neighbour] <= distance + STRAIGHT:
+                        cost[neighbour] = distance + STRAIGHT
+                        buckets[(distance + STRAIGHT) % (DIAGONAL + 1)].append(neighbour)
+                        pending += 1
+            for dx, dy in diagonal:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < width and 0 <= ny < height:
+                    neighbour = tile + dy * width + dx
+                    if (free[neighbour] and free[tile + dx] and free[tile + dy * width]
+                            and not 0 <= cost[neighbour] <= distance + DIAGONAL):
+                        cost[neighbour] = distance + DIAGONAL
+                        buckets[(distance + DIAGONAL) % (DIAGONAL + 1)].append(neighbour)
+                        pending += 1
+        distance += 1
+
+    field = np.array(cost, dtype=np.float32).reshape(height, width) / STRAIGHT
+    field[field < 0] = UNREACHABLE
+    return field
+
+
+def octile_distance(dx, dy):
+    """The octile distance of an offset on an open grid, what distance_field gives without walls"""
+    dx = np.abs(dx)
+    dy = np.abs(dy)
+    return (STRAIGHT * np.maximum(dx, dy) + (DIAGONAL - STRAIGHT) * np.minimum(dx, dy)) / STRAIGHT
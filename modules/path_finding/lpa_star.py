@@ -1,124 +1,203 @@
-from library import Point2D
-from modules.py_unit import PyUnit
-from modules.path_finding.vertex import Vertex
-from modules.path_finding.custom_priority_queue import CustomPriorityQueue
-import copy
-import math
-
-
-
-
-
-def neighbouringVertexes(current_vertex : Vertex, vertexes : dict):
-    neighbour_list = []
-    for x_cord in range(current_vertex.position_x - 1, current_vertex.position_x + 2):
-        for y_cord in range(current_vertex.position_y - 1, current_vertex.position_y + 2):
-            if((current_vertex.position_x, current_vertex.position_y) != (x_cord, y_cord)): 
-                current_neighbour = vertexes.get((x_cord, y_cord))
-                if(current_neighbour != None):
-                    neighbour_list.append((current_neighbour.position_x, current_neighbour.position_y))
-    return neighbour_list
-'''
-def calculateHeuristic(first_vertex : Vertex, second_vertex: Vertex):
-    Vertex.distance = lambda self, other: abs(self.position_x - other.position_x) + abs(self.position_y - other.position_y)
-    return first_vertex.distance(second_vertex)
-'''
-
-def calculateHeuristic(first_vertex: Vertex, second_vertex: Vertex):
-    Vertex.distance = lambda self, other: math.sqrt((self.position_x - other.position_x)**2 + (self.position_y - other.position_y)**2)
-    return first_vertex.distance(second_vertex)
-
-
-def calculateKey(vertexes: dict, current_point: (int, int), goal_point: (int, int)):
-    kv_0 = min(vertexes[current_point].g_value, vertexes[current_point].rhs_value) + calculateHeuristic(vertexes[current_point], vertexes[goal_point])
-    kv_1 = min(vertexes[current_point].g_value, vertexes[current_point].rhs_value)
-    return (kv_0, kv_1)
-
-def updateVertex(priority_queue : CustomPriorityQueue, secondary_queue : list, vertexes : dict, current_point : (int, int), start_point : (int, int), goal_point : (int, int)):
-        neighbour_list = neighbouringVertexes(vertexes[current_point], vertexes)
-        if(vertexes[current_point] != vertexes[start_point]):
-            lowest_value = math.inf
-            for neighbour in neighbour_list:
-                neighbour_value = vertexes[neighbour].g_value + calculateHeuristic(vertexes[current_point], vertexes[neighbour])
-                if(neighbour_value < lowest_value):
-                    lowest_value = neighbour_value
-            vertexes[current_point].rhs_value = lowest_value
-        if(vertexes[current_point].g_value != vertexes[current_point].rhs_value):
-            # curr_point = (5, 5)
-            # start_point = (1, 2)
-            # goal_point = (10, 10)
-
-            priority_queue.update((calculateKey(vertexes, current_point, goal_point), current_point))
-            # ((15, 0), vertex.point)
-
-            
-
-
-def computeShortestPath(priority_queue : CustomPriorityQueue, secondary_queue: list, vertexes : dict, start_point : (int, int), goal_point : (int, int)):
-        top_element = priority_queue.peek()
-        top_key = top_element[0]
-        top_point = top_element[1]
-        while(top_key < calculateKey(vertexes, goal_point, goal_point) or vertexes[goal_point].rhs_value != vertexes[goal_point].g_value):
-            print("fast här")
-            
-            parent_point = top_point
-            
-            
-            #print("top_point", top_point)
-            
-            """while(True):
-                print("i true loopen")
-                if(priority_queue.peek() not in secondary_queue):
-                    priority_queue.get()
-                else:
-                    break"""
-            
-            top_element = priority_queue.get()
-            top_key = top_element[0]
-            top_point = top_element[1]
-            #secondary_queue.remove((top_key, top_point))
-            
-            
-            vertexes[parent_point].child = vertexes[top_point]
-            
-            if(top_point == goal_point): 
-                print("goal found", top_point)
-                return vertexes[top_point].build_path()
-           
-            #print(vertexes[top_point].parent)
-           
-            if(vertexes[top_point].g_value > vertexes[top_point].rhs_value):
-                vertexes[top_point].g_value = vertexes[top_point].rhs_value
-                neighbour_list = neighbouringVertexes(vertexes[top_point], vertexes)
-                for neighbour in neighbour_list:
-                    updateVertex(priority_queue, secondary_queue, vertexes, neighbour, start_point, goal_point)
-           
+"""
+Lifelong Planning A* (LPA*) over the walkability grid.
+
+The g and rhs values of the tiles live in flat float32 arrays indexed by tile id. The grid is padded with a border
+of blocked tiles, so the id of tile (x, y) is (y + 1) * stride + x + 1 with stride the width plus two, and the eight
+neighbours of a tile are fixed offsets from its id without any bounds check. Steps cost STRAIGHT and DIAGONAL like in
+grid_search, and a diagonal step needs both tiles beside it free, so the distances are the ones of distance_field.
+The open list is a heapq with lazy deletion: an entry is not removed when the key of its tile changes, it is
+skipped when popped if the key no longer matches or the tile became consistent.
+
+After a search the planner can be told about tiles whose walkability changed with update_tiles, and the next
+compute_shortest_path only repairs the part of the search those changes affect. IntegrationField uses this to keep
+the ground distance from a target to every tile up to date while buildings come and go: it is an LPAStar rooted at
+the target without a goal, started from the consistent state a distance_field gives, and repair passes it the tiles
+of the footprints that changed, see MapGrids.tiles_changed_since.
+
+Usage:
+    python lpa_star.py walkable.npy
+times path queries between random walkable tiles of the grid.
+"""
+from __future__ import annotations
+import heapq
+import sys
+import time
+
+import numpy as np
+
+from modules.path_finding.grid_search import DIAGONAL, STRAIGHT, UNREACHABLE, distance_field
+
+# (dx, dy) of the neighbours, the straight ones first
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, 1), (1, -1), (-1, -1))
+
+Tile = tuple[int, int]
+
+
+class LPAStar:
+
+    def __init__(self, walkable: np.ndarray, start: Tile, goal: Tile):
+        height, width = walkable.shape
+        self.stride = width + 2
+        self.free: list[bool] = np.pad(np.asarray(walkable, dtype=bool), 1).ravel().tolist()
+        size = len(self.free)
+        self.g = np.full(size, UNREACHABLE, dtype=np.float32)
+        self.rhs = np.full(size, UNREACHABLE, dtype=np.float32)
+        # Item access through a memoryview gives Python floats, much faster than indexing the arrays
+        self._g = memoryview(self.g)
+        self._rhs = memoryview(self.rhs)
+        # Offset of the neighbour, cost of the step and offsets of the two tiles beside it that must be free
+        self.steps: list[tuple[int, int, int, int]] = []
+        for dx, dy in NEIGHBOURS:
+            offset = dy * self.stride + dx
+            if dx and dy:
+                self.steps.append((offset, DIAGONAL, dx, dy * self.stride))
             else:
-                vertexes[top_point].g_value = math.inf
-                neighbour_list = neighbouringVertexes(vertexes[top_point], vertexes)
-                neighbour_list.append(top_point)
-                for neighbour in neighbour_list:
-                    updateVertex(priority_queue, secondary_queue, vertexes, neighbour, start_point, goal_point)
-        return [] #return empty path if no path is found
-     
-
-def lpaMain(agent : 'BasicAgent', py_unit : PyUnit, start_point: (int, int), target_point: (int, int)):
-    priority_queue = CustomPriorityQueue()
-    secondary_queue = []
-    vertexes = copy.deepcopy(agent.vertex_dict)
-    vertexes[start_point].rhs_value = 0
-    priority_queue.put((calculateKey(vertexes, start_point, target_point), start_point))
-    secondary_queue.append((calculateKey(vertexes, start_point, target_point), start_point))
-    
-    
-    while(start_point != target_point):
-        path = computeShortestPath(priority_queue, secondary_queue, vertexes, start_point, target_point)
-        print("path", path)
-        for i in range(len(path)):
-            next_vertex = path[i]
-            next_point = (next_vertex.position_x, next_vertex.position_y)
-            start_point = next_point
-            py_unit.move(Point2D(next_point[0], next_point[1]))
-        #computeShortestPath()
-    print("done")
+                self.steps.append((offset, STRAIGHT, offset, offset))
+        self.heap: list[tuple[float, float, int]] = []
+
+        self.start = self.tile_id(*start)
+        self.goal = self.tile_id(*goal)
+        self.goal_x, self.goal_y = self.position(self.goal)
+        self._rhs[self.start] = 0
+        heapq.heappush(self.heap, self.key(self.start) + (self.start,))
+
+    def tile_id(self, x: int, y: int) -> int:
+        return (int(y) + 1) * self.stride + int(x) + 1
+
+    def position(self, tile: int) -> Tile:
+        y, x = divmod(tile, self.stride)
+        return x - 1, y - 1
+
+    def edges(self, tile: int) -> list[tuple[int, int]]:
+        """The free neighbours of the tile and the cost of the step to them"""
+        free = self.free
+        if not free[tile]:
+            return []
+        return [(tile + offset, cost) for offset, cost, side_a, side_b in self.steps
+                if free[tile + offset] and free[tile + side_a] and free[tile + side_b]]
+
+    def heuristic(self, tile: int) -> int:
+        """Octile distance to the goal, in the units of the step costs"""
+        y, x = divmod(tile, self.stride)
+        dx = abs(x - 1 - self.goal_x)
+        dy = abs(y - 1 - self.goal_y)
+        return STRAIGHT * max(dx, dy) + (DIAGONAL - STRAIGHT) * min(dx, dy)
+
+    def key(self, tile: int) -> tuple[float, float]:
+        value = min(self._g[tile], self._rhs[tile])
+        return value + self.heuristic(tile), value
+
+    def update_vertex(self, tile: int):
+        g, rhs = self._g, self._rhs
+        if tile != self.start:
+            rhs[tile] = min((g[neighbour] + cost for neighbour, cost in self.edges(tile)), default=UNREACHABLE)
+        if g[tile] != rhs[tile]:
+            heapq.heappush(self.heap, self.key(tile) + (tile,))
+
+    def compute_shortest_path(self) -> bool:
+        """Expands tiles until the goal is consistent, returns whether the goal can be reached"""
+        g, rhs, heap = self._g, self._rhs, self.heap
+        goal = self.goal
+        while heap:
+            k1, k2, tile = heap[0]
+            if (k1, k2) >= self.key(goal) and g[goal] == rhs[goal]:
+                break
+            heapq.heappop(heap)
+            if g[tile] == rhs[tile] or (k1, k2) != self.key(tile):
+                continue    # Outdated entry
+            if g[tile] > rhs[tile]:
+                # The rhs of a neighbour can only drop to a path through this tile, no need to look at all of its own
+                value = g[tile] = rhs[tile]
+                for neighbour, cost in self.edges(tile):
+                    if value + cost < rhs[neighbour] and neighbour != self.start:
+                        rhs[neighbour] = value + cost
+                        if g[neighbour] != value + cost:
+                            heapq.heappush(heap, self.key(neighbour) + (neighbour,))
+            else:
+                g[tile] = UNREACHABLE
+                self.update_vertex(tile)
+                for neighbour, _ in self.edges(tile):
+                    self.update_vertex(neighbour)
+        return rhs[goal] != UNREACHABLE
+
+    def update_tiles(self, walkable: np.ndarray, tiles):
+        """Reads the walkability of the (x, y) tiles from the grid again, the next search repairs the paths"""
+        height, width = walkable.shape
+        affected = set()
+        for x, y in tiles:
+            if not (0 <= x < width and 0 <= y < height):
+                continue
+            tile = self.tile_id(x, y)
+            self.free[tile] = bool(walkable[y, x])
+            affected.add(tile)
+            affected.update(tile + offset for offset, _, _, _ in self.steps)
+        for tile in affected:
+            self.update_vertex(tile)
+
+    def distance(self) -> float:
+        """Length of the shortest path in tiles, UNREACHABLE if there is none"""
+        return self._rhs[self.goal] / STRAIGHT
+
+    def path(self) -> list[Tile]:
+        """The tiles of the shortest path from the start to the goal, both included, empty if there is none"""
+        if self._rhs[self.goal] == UNREACHABLE:
+            return []
+        g = self._g
+        tile = self.goal
+        path = [tile]
+        while tile != self.start:
+            tile = min(self.edges(tile), key=lambda edge: g[edge[0]] + edge[1])[0]
+            path.append(tile)
+        path.reverse()
+        return [self.position(tile) for tile in path]
+
+
+class IntegrationField(LPAStar):
+
+    def __init__(self, walkable: np.ndarray, target: Tile):
+        # The goal is a corner of the padding, which is never reached, so a search runs until every tile is consistent
+        super().__init__(walkable, target, (-1, -1))
+        height, width = walkable.shape
+        field = distance_field(walkable, [target])
+        values = np.where(np.isfinite(field), np.rint(field * STRAIGHT), UNREACHABLE)
+        self.g.reshape(height + 2, width + 2)[1:-1, 1:-1] = values
+        self.rhs.reshape(height + 2, width + 2)[1:-1, 1:-1] = values
+        self.heap.clear()
+
+    def heuristic(self, tile: int) -> int:
+        return 0
+
+    def field(self) -> np.ndarray:
+        """The distance to the target in tiles of every tile, UNREACHABLE where there is no path"""
+        return self.g.reshape(-1, self.stride)[1:-1, 1:-1] / STRAIGHT
+
+    def repair(self, walkable: np.ndarray, tiles):
+        """Brings the field up to date with the walkability of the changed (x, y) tiles, searching what they affect"""
+        self.update_tiles(walkable, tiles)
+        self.compute_shortest_path()
+
+
+def shortest_path(walkable: np.ndarray, start: Tile, goal: Tile) -> list[Tile]:
+    """The tiles of a shortest path from the start to the goal, empty if there is none"""
+    planner = LPAStar(walkable, start, goal)
+    planner.compute_shortest_path()
+    return planner.path()
+
+
+def benchmark(walkable: np.ndarray, queries: int = 200, seed: int = 0) -> dict:
+    """Times shortest_path between random pairs of walkable tiles of a grid, like the walkable.npy of a map bundle"""
+    rng = np.random.default_rng(seed)
+    ys, xs = np.nonzero(walkable)
+    pairs = rng.integers(0, len(xs), (queries, 2))
+    start = time.perf_counter()
+    found = 0
+    for a, b in pairs:
+        found += bool(shortest_path(walkable, (xs[a], ys[a]), (xs[b], ys[b])))
+    elapsed = time.perf_counter() - start
+    return dict(queries=queries, found=found, seconds=elapsed, per_second=queries / elapsed)
+
 
+if __name__ == "__main__":
+    row = benchmark(np.load(sys.argv[1]))
+    print(f"{row['queries']} queries, {row['found']} paths found in {row['seconds']:.2f} s, "
+          f"{row['per_second']:.1f} queries/s")
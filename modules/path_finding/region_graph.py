@@ -0,0 +1,120 @@
+"""
+Graph of the regions with the chokepoints between them as edges, and the ground distances between its points.
+
+The points of the graph are the chokepoint centers, the base locations and the region centers. At start a
+distance_field is computed from each of them, so the ground distance from a point to any tile is one array read, and
+the distances between all points form a matrix. Routes between regions are precomputed over the region graph with
+Floyd-Warshall, an edge between two regions costing the shortest ground distance from the center of one to the
+center of the other through one of their chokepoints.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import numpy as np
+from library import BaseLocation, Point2D
+
+from modules.map_bundle import load_or_build
+from modules.path_finding.grid_search import UNREACHABLE, distance_field
+
+if TYPE_CHECKING:
+    from modules.potential_flow.regions import Chokepoint, Region, RegionManager
+
+
+class RegionGraph:
+
+    def __init__(self, region_manager: RegionManager):
+        agent = region_manager.agent
+        self.regions = region_manager.regions
+        # Sorted so that the order of the fields in the map bundle is the same every launch
+        self.chokepoints: list[Chokepoint] = sorted(region_manager.chokepoints,
+                                                    key=lambda choke: (choke.center.x, choke.center.y))
+        self.bases: list[BaseLocation] = sorted(agent.base_location_manager.base_locations,
+                                                key=lambda base: (base.position.x, base.position.y))
+
+        self.points: list[Point2D] = ([choke.center for choke in self.chokepoints]
+                                      + [base.position for base in self.bases]
+                                      + [region.center for region in self.regions])
+        self.index: dict[tuple[float, float], int] = {}
+        for i, point in enumerate(self.points):
+            self.index.setdefault((point.x, point.y), i)
+        self.region_point = len(self.chokepoints) + len(self.bases)  # Index of the center of the first region
+
+        walkable = region_manager.walkable
+        self.fields = load_or_build(agent.map_bundle, "ground_distance", lambda: np.stack(
+            [distance_field(walkable, [(point.x, point.y)]) for point in self.points]))
+        xs = np.array([int(point.x) for point in self.points])
+        ys = np.array([int(point.y) for point in self.points])
+        self.matrix: np.ndarray = self.fields[:, ys, xs]  # [from point, to point]
+
+        self.edges = self.find_edges(region_manager.labels)
+        self.route_distance, self.next_region, self.via = self.find_routes()
+
+    def find_edges(self, labels: np.ndarray) -> dict[tuple[int, int], list[int]]:
+        """Returns the chokepoints between each pair of regions (a, b), a < b, as indices into chokepoints"""
+        edges: dict[tuple[int, int], list[int]] = {}
+        for i, choke in enumerate(self.chokepoints):
+            touching = set()
+            for tile in choke.tiles:
+                window = labels[max(tile.y - 1, 0):tile.y + 2, max(tile.x - 1, 0):tile.x + 2]
+                touching.update(int(region_id) for region_id in window[window > 0])
+            touching = sorted(touching)
+            for j, a in enumerate(touching):
+                for b in touching[j + 1:]:
+                    edges.setdefault((a, b), []).append(i)
+        return edges
+
+    def find_routes(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Floyd-Warshall over the regions, indexed by region id.
+        Returns the route distances, the next region on the route and the chokepoint to it, -1 where there is none.
+        """
+        size = len(self.regions) + 1
+        distance = np.full((size, size), UNREACHABLE)
+        next_region = np.full((size, size), -1, dtype=int)
+        via = np.full((size, size), -1, dtype=int)
+        np.fill_diagonal(distance, 0)
+        np.fill_diagonal(next_region, np.arange(size))
+        for (a, b), chokes in self.edges.items():
+            center_a = self.region_point + a - 1
+            center_b = self.region_point + b - 1
+            for i in chokes:
+                cost = self.matrix[center_a, i] + self.matrix[i, center_b]
+                if cost < distance[a, b]:
+                    distance[a, b] = distance[b, a] = cost
+                    next_region[a, b], next_region[b, a] = b, a
+                    via[a, b] = via[b, a] = i
+
+        for k in range(1, size):
+            through = distance[:, k, None] + distance[None, k, :]
+            shorter = through < distance
+            distance = np.where(shorter, through, distance)
+            next_region = np.where(shorter, next_region[:, k, None], next_region)
+            via = np.where(shorter, via[:, k, None], via)
+        return distance, next_region, via
+
+    def distance(self, a: Region, b: Region) -> float:
+        """Ground distance between the centers of two regions"""
+        return float(self.matrix[self.region_point + a.id - 1, self.region_point + b.id - 1])
+
+    def route(self, a: Region, b: Region) -> list[Chokepoint] | None:
+        """The chokepoints crossed on the way from region a to region b, None if b cannot be reached"""
+        if self.next_region[a.id, b.id] < 0:
+            return None
+        route = []
+        current = a.id
+        while current != b.id:
+            route.append(self.chokepoints[self.via[current, b.id]])
+            current = self.next_region[current, b.id]
+        return route
+
+    def ground_distance(self, source: Point2D, target: Point2D) -> float:
+        """Ground distance from a point of the graph to any position, UNREACHABLE if there is no path"""
+        return float(self.fields[self.index[(source.x, source.y)], int(target.y), int(target.x)])
+
+    def closest_chokepoint(self, position: Point2D) -> Chokepoint:
+        """The chokepoint closest to the position by ground, by straight distance if none can be reached"""
+        x, y = int(position.x), int(position.y)
+        distances = self.fields[:len(self.chokepoints), y, x]
+        if not np.isfinite(distances).any():
+            distances = np.array([position.distance(choke.center) for choke in self.chokepoints])
+        return self.chokepoints[int(np.argmin(distances))]
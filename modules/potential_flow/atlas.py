@@ -0,0 +1,152 @@
+"""
+Precomputed static part of the scout's potential field.
+
+region_pval and border_pval only depend on the scout position, the region it is in and whether that region is the
+target region. The atlas samples both terms once on a regular sub-tile grid and answers later queries with a
+bilinear lookup, so calculate_pval gets them from one lookup instead of integrating over every border segment.
+
+The stored fields are the unit vortex and source flows, the scout's constants and corrections are applied at lookup.
+This way reset_constants and reverse_flows never invalidate the atlas, it only depends on the map and is built once.
+The border is sampled in its segment form, see Region.border_segments. The sampled arrays are kept in the agent's
+map bundle when there is one.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import numpy as np
+from library import Point2D
+
+from modules.map_bundle import load_or_build_many
+from modules.potential_flow.flows import (
+    line_source_potential_batch,
+    line_vortex_potential_batch,
+    source_potential_batch,
+    vortex_potential_batch,
+)
+
+if TYPE_CHECKING:
+    from modules.potential_flow.regions import RegionManager
+
+ATLAS_RESOLUTION = 2  # Samples per tile side
+ATLAS_CHUNK_SIZE = 4096  # Samples evaluated together against the border segments of their region
+
+# Channels of PotentialAtlas.values
+REGION_VORTEX = slice(0, 2)
+REGION_SOURCE = slice(2, 4)
+BORDER_VORTEX = slice(4, 6)
+BORDER_SOURCE = slice(6, 8)
+CHANNELS = 8
+
+
+class PotentialAtlas:
+    """
+    Region and border flows sampled at ((i + 0.5) / resolution, (j + 0.5) / resolution), stored as a float32
+    (height * resolution, width * resolution, CHANNELS) array indexed [y, x].
+    A sample only belongs to the region of its tile, so a lookup only interpolates between the samples in the same
+    region as the query and renormalises the weights of the ones it keeps.
+    """
+
+    def __init__(self, region_manager: RegionManager, resolution: int = ATLAS_RESOLUTION):
+        self.resolution = resolution
+        self.labels = region_manager.tile_labels.repeat(resolution, axis=0).repeat(resolution, axis=1)
+        # inactive: samples where a non-target region turns its border flow off, being close to a chokepoint
+        self.values, self.inactive = load_or_build_many(
+            region_manager.agent.map_bundle, (f"atlas_{resolution}_values", f"atlas_{resolution}_inactive"),
+            lambda: self.build(region_manager))
+
+    def build(self, region_manager: RegionManager) -> tuple[np.ndarray, np.ndarray]:
+        """Samples the flows of every region, returns the values and inactive arrays"""
+        width = region_manager.agent.map_tools.width
+        height = region_manager.agent.map_tools.height
+        values = np.zeros(self.labels.shape + (CHANNELS,), dtype=np.float32)
+        inactive = np.zeros(self.labels.shape, dtype=bool)
+
+        points = sample_points(width, height, self.resolution)
+        chokepoints = np.array([(choke.x, choke.y) for choke in region_manager.chokepoints_as_centers], dtype=float)
+        for region in region_manager.regions:
+            rows, cols = np.nonzero(self.labels == region.id)
+            center = np.array([region.center.x, region.center.y])
+            start, end, weight = region.border_segments
+            distance = region.active_border_distance
+            for chunk in range(0, len(rows), ATLAS_CHUNK_SIZE):
+                row = rows[chunk:chunk + ATLAS_CHUNK_SIZE]
+                col = cols[chunk:chunk + ATLAS_CHUNK_SIZE]
+                pts = points[row, col]
+                block = values[row, col]
+                block[:, REGION_VORTEX] = vortex_potential_batch(center, pts)
+                block[:, REGION_SOURCE] = source_potential_batch(center, pts)
+                block[:, BORDER_VORTEX] = line_vortex_potential_batch(start, end, weight, pts[:, None], distance).sum(1)
+                block[:, BORDER_SOURCE] = line_source_potential_batch(start, end, weight, pts[:, None], distance).sum(1)
+                values[row, col] = block
+                if len(chokepoints):
+                    d_choke = np.hypot(chokepoints[None, :, 0] - pts[:, None, 0],
+                                       chokepoints[None, :, 1] - pts[:, None, 1]).min(axis=1)
+                    inactive[row, col] = d_choke < distance + 4
+        return values, inactive
+
+    def memory_usage(self) -> int:
+        """Returns the number of bytes taken by the sampled fields"""
+        return self.labels.nbytes + self.values.nbytes + self.inactive.nbytes
+
+    def lookup(self, region_id: int, is_target: bool, pos: Point2D) -> np.ndarray | None:
+        """
+        Returns the CHANNELS unit flows at pos for a scout in the region, None if no sample around pos is in it.
+        Outside of the target region the border channels are zero near chokepoints, like in border_pval.
+        """
+        fx = pos.x * self.resolution - 0.5
+        fy = pos.y * self.resolution - 0.5
+        x0 = int(np.floor(fx))
+        y0 = int(np.floor(fy))
+        if not (0 <= x0 < self.labels.shape[1] - 1 and 0 <= y0 < self.labels.shape[0] - 1):
+            return None
+        tx = fx - x0
+        ty = fy - y0
+        weights = np.array([[(1 - tx) * (1 - ty), tx * (1 - ty)], [(1 - tx) * ty, tx * ty]])
+        weights *= self.labels[y0:y0 + 2, x0:x0 + 2] == region_id
+        total = weights.sum()
+        if total <= 0:
+            return None
+        block = self.values[y0:y0 + 2, x0:x0 + 2]
+        values = (block * (weights / total)[..., None]).sum(axis=(0, 1))
+        if not is_target:
+            border_weights = weights * ~self.inactive[y0:y0 + 2, x0:x0 + 2] / total
+            values[BORDER_VORTEX] = (block[..., BORDER_VORTEX] * border_weights[..., None]).sum(axis=(0, 1))
+            values[BORDER_SOURCE] = 0
+        return values
+
+    def lookup_batch(self, region_ids: np.ndarray, is_target: np.ndarray, points: np.ndarray):
+        """
+        Batched lookup for (N, 2) points.
+        Returns the flows as an (N, CHANNELS) array and a mask of the points that could be looked up.
+        """
+        height, width = self.labels.shape
+        fx = points[:, 0] * self.resolution - 0.5
+        fy = points[:, 1] * self.resolution - 0.5
+        x0 = np.floor(fx).astype(int)
+        y0 = np.floor(fy).astype(int)
+        in_bounds = (x0 >= 0) & (x0 < width - 1) & (y0 >= 0) & (y0 < height - 1)
+        tx = (fx - x0)[:, None]
+        ty = (fy - y0)[:, None]
+        x0 = np.clip(x0, 0, width - 2)[:, None]
+        y0 = np.clip(y0, 0, height - 2)[:, None]
+        rows = y0 + [0, 0, 1, 1]
+        cols = x0 + [0, 1, 0, 1]
+        weights = np.concatenate(((1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty), axis=1)
+        weights *= self.labels[rows, cols] == region_ids[:, None]
+        total = weights.sum(axis=1)
+        found = in_bounds & (total > 0)
+        weights[found] /= total[found, None]
+        weights[~found] = 0
+
+        corners = self.values[rows, cols]
+        values = (corners * weights[..., None]).sum(axis=1)
+        border_weights = np.where(is_target[:, None], weights, weights * ~self.inactive[rows, cols])
+        values[:, BORDER_VORTEX] = (corners[..., BORDER_VORTEX] * border_weights[..., None]).sum(axis=1)
+        values[:, BORDER_SOURCE] *= is_target[:, None]
+        return values, found
+
+
+def sample_points(width: int, height: int, resolution: int) -> np.ndarray:
+    """Returns the positions of the samples of a field as a (height * resolution, width * resolution, 2) array"""
+    ys, xs = np.mgrid[0:height * resolution, 0:width * resolution]
+    return np.stack(((xs + 0.5) / resolution, (ys + 0.5) / resolution), axis=-1)
@@ -0,0 +1,187 @@
+"""
+Evaluation of the complete scout potential field at many points at once.
+
+evaluate_field gives the field at N arbitrary points and evaluate_field_grid at the center of every tile of the map.
+Both combine the same region, border, attract point and unit terms as calculate_pval, but with NumPy over all
+points instead of one Python evaluation per point. Every point is treated as if the scout stood there, so a point
+uses the region it is in and only the enemies the scout would see from that tile.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import numpy as np
+from library import PLAYER_ENEMY
+
+from modules.potential_flow.atlas import BORDER_SOURCE, BORDER_VORTEX, REGION_SOURCE, REGION_VORTEX
+from modules.potential_flow.flows import (
+    line_source_potential_batch,
+    line_vortex_potential_batch,
+    source_potential_batch,
+    vortex_potential_batch,
+)
+from modules.potential_flow.potentials import EXTEND, OFF, ON, SMALL, TILE_SIZE, UnitBatch, pack_units, units_pval
+
+if TYPE_CHECKING:
+    from modules.py_unit import PyUnit
+    from modules.potential_flow.regions import RegionManager
+    from tasks.pf_scout import PFscout
+
+CHUNK_SIZE = 2048  # Points evaluated together against all units, bounds the size of the (N, M) temporaries
+
+
+def evaluate_field(scout: PFscout, scout_unit: PyUnit, points, enemies=None, attract: bool = True) -> np.ndarray:
+    """
+    Returns the scout's potential value at each of the points as an (N, 2) array.
+
+    :param points: (N, 2) array-like of positions.
+    :param enemies: The enemies to take into account, all known enemies if None. Can be packed already by pack_units.
+    :param attract: Whether to add the attract point term, which calculate_pval leaves out.
+    Points outside of every region get a zero vector.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    region_manager = scout.agent.region_manager
+    field = np.zeros((len(points), 2))
+
+    region_ids = region_manager.get_region_ids(np.floor(points[:, 0]), np.floor(points[:, 1]))
+    valid = region_ids > 0
+    if not valid.any():
+        return field
+    points = points[valid]
+    region_ids = region_ids[valid]
+    centers = region_centers(region_manager)[region_ids]
+
+    if enemies is None:
+        enemies = scout.agent.unit_collection.get_group(PLAYER_ENEMY)
+
+    values = unit_field(scout, scout_unit, points, centers, enemies)
+    found = np.zeros(len(points), dtype=bool)
+    if scout.USE_ATLAS:
+        static, found = atlas_field(scout, scout_unit, points, region_ids, centers)
+        values += static
+    missing = ~found
+    values[missing] += region_field(scout, scout_unit, points[missing], region_ids[missing], centers[missing])
+    values[missing] += border_field(scout, points[missing], region_ids[missing])
+    if attract:
+        values += attract_field(scout, points)
+    field[valid] = values
+    return field
+
+
+def evaluate_field_grid(scout: PFscout, scout_unit: PyUnit, enemies=None, attract: bool = True) -> np.ndarray:
+    """Returns the potential value at the center of every tile as a (height, width, 2) array indexed [y, x]"""
+    width = scout.agent.map_tools.width
+    height = scout.agent.map_tools.height
+    ys, xs = np.mgrid[0:height, 0:width]
+    points = np.stack((xs.ravel() + 0.5, ys.ravel() + 0.5), axis=-1)
+    return evaluate_field(scout, scout_unit, points, enemies, attract).reshape(height, width, 2)
+
+
+def region_centers(region_manager: RegionManager) -> np.ndarray:
+    """Returns the region centers as an array indexed by region id, row 0 is unused"""
+    centers = np.zeros((max(region_manager.region_by_id) + 1, 2))
+    for region_id, region in region_manager.region_by_id.items():
+        centers[region_id] = region.center.x, region.center.y
+    return centers
+
+
+def unit_field(scout: PFscout, scout_unit: PyUnit, points: np.ndarray, centers: np.ndarray, enemies) -> np.ndarray:
+    """Batched unit term, each point only sees the enemies in the tiles get_enemies_in_neighbouring_tiles gives"""
+    field = np.zeros((len(points), 2))
+    units = enemies if isinstance(enemies, UnitBatch) else pack_units(scout, scout_unit, enemies)
+    if not len(units.position):
+        return field
+
+    dist = int(scout_unit.unit_type.sight_range + 2)
+    unit_tiles = np.floor(units.position)
+    for start in range(0, len(points), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        point_tiles = np.floor(points[chunk])
+        dx = np.abs(unit_tiles[None, :, 0] - point_tiles[:, None, 0])
+        dy = np.abs(unit_tiles[None, :, 1] - point_tiles[:, None, 1])
+        visible = (dx <= dist) & (dy <= dist) & ((dx > 0) | (dy > 0))
+        field[chunk] = units_pval(scout, units, points[chunk], centers[chunk], visible)[0]
+    return field
+
+
+def region_corrections(scout: PFscout, scout_unit: PyUnit, points: np.ndarray, region_ids: np.ndarray,
+                       centers: np.ndarray):
+    """Returns the factors region_pval scales its vortex and source flows with, each of shape (N, 1)"""
+    target_id = scout.target_region.id if scout.target_region else 0
+    is_target = region_ids == target_id
+    vortex_correction = np.where(is_target, ON, SMALL)
+    source_correction = np.where(is_target, ON, OFF)
+
+    d_center = np.hypot(points[:, 0] - centers[:, 0], points[:, 1] - centers[:, 1])
+    threshold = scout_unit.unit_type.sight_range + EXTEND
+    sign = np.where(d_center < threshold, 1.0, -1.0)
+    return ((scout.CENTER_VORTEX * vortex_correction)[:, None],
+            (scout.CENTER_SOURCE_SINK * source_correction * sign)[:, None])
+
+
+def region_field(scout: PFscout, scout_unit: PyUnit, points: np.ndarray, region_ids: np.ndarray,
+                 centers: np.ndarray) -> np.ndarray:
+    """Batched region_pval"""
+    vortex_factor, source_factor = region_corrections(scout, scout_unit, points, region_ids, centers)
+    return (vortex_potential_batch(centers, points) * vortex_factor
+            + source_potential_batch(centers, points) * source_factor)
+
+
+def atlas_field(scout: PFscout, scout_unit: PyUnit, points: np.ndarray, region_ids: np.ndarray,
+                centers: np.ndarray):
+    """
+    region_field plus border_field looked up in the region manager's atlas.
+    Returns the field and a mask of the points the atlas covers, the others are left zero.
+    """
+    target_id = scout.target_region.id if scout.target_region else 0
+    samples, found = scout.agent.region_manager.atlas.lookup_batch(region_ids, region_ids == target_id, points)
+    vortex_factor, source_factor = region_corrections(scout, scout_unit, points, region_ids, centers)
+    return (samples[:, REGION_VORTEX] * vortex_factor
+            + samples[:, REGION_SOURCE] * source_factor
+            + samples[:, BORDER_VORTEX] * scout.BORDER_VORTEX
+            + samples[:, BORDER_SOURCE] * scout.BORDER_SOURCE), found
+
+
+def border_field(scout: PFscout, points: np.ndarray, region_ids: np.ndarray) -> np.ndarray:
+    """Batched border_pval, points are grouped by region and evaluated against that region's border"""
+    region_manager = scout.agent.region_manager
+    field = np.zeros((len(points), 2))
+    target_id = scout.target_region.id if scout.target_region else 0
+    chokepoints = np.array([(choke.x, choke.y) for choke in region_manager.chokepoints_as_centers], dtype=float)
+
+    for region_id in np.unique(region_ids):
+        in_region = region_ids == region_id
+        border = region_manager.region_by_id[region_id].border_array
+        active_distance = region_manager.region_by_id[region_id].active_border_distance
+        pts = points[in_region]
+
+        is_target = region_id == target_id
+        inactive = np.zeros(len(pts), dtype=bool)
+        if not is_target and len(chokepoints):
+            d_choke = np.hypot(chokepoints[None, :, 0] - pts[:, None, 0],
+                               chokepoints[None, :, 1] - pts[:, None, 1]).min(axis=1)
+            inactive = d_choke < active_distance + 4
+
+        if scout.USE_BORDER_SEGMENTS:
+            start, end, weight = region_manager.region_by_id[region_id].border_segments
+            pval = line_vortex_potential_batch(start, end, weight, pts[:, None], active_distance) * scout.BORDER_VORTEX
+            if is_target:
+                pval += (line_source_potential_batch(start, end, weight, pts[:, None], active_distance)
+                         * scout.BORDER_SOURCE)
+            active = np.ones(pval.shape[:2], dtype=bool)
+        else:
+            pval = vortex_potential_batch(border[None], pts[:, None]) * scout.BORDER_VORTEX
+            if is_target:
+                pval += source_potential_batch(border[None], pts[:, None]) * scout.BORDER_SOURCE
+            active = np.hypot(border[None, :, 0] - pts[:, None, 0],
+                               border[None, :, 1] - pts[:, None, 1]) < active_distance
+
+        field[in_region] = (pval * (active & ~inactive[:, None])[..., None]).sum(axis=1)
+    return field
+
+
+def attract_field(scout: PFscout, points: np.ndarray) -> np.ndarray:
+    """Batched attract_point_pval"""
+    if not scout.attract_points:
+        return np.zeros((len(points), 2))
+    attract_points = np.array([(point.x, point.y) for point in scout.attract_points], dtype=float)
+    return source_potential_batch(attract_points[None], points[:, None]).sum(axis=1) * (-TILE_SIZE)
@@ -0,0 +1,90 @@
+"""
+Reuse of the scout's field between frames where its inputs have not changed.
+
+PFscout is a high frequency task, so PFscout.move evaluates the field every frame even though most frames of a scout
+run differ from the one before only by the scout having moved within its tile. FieldCache keeps the last result
+together with the inputs it was computed from, and PFscout.move only recomputes the field when those differ: another
+set of enemies, an enemy that moved more than the epsilon or started or stopped targeting the scout, another scout
+tile, target region, set of attract points or direction.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Iterable, NamedTuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from modules.py_unit import PyUnit
+    from tasks.pf_scout import PFscout
+
+FIELD_CACHE_EPSILON = 0.25  # Distance in tiles an enemy can move before the field is recomputed
+
+
+class FieldInputs(NamedTuple):
+    """What the scout's field depends on, see field_inputs"""
+    scout_tile: tuple[int, int]
+    target_region: int
+    attract_points: frozenset
+    forward: int
+    enemy_ids: tuple
+    enemy_positions: np.ndarray  # (M, 2), in the order of enemy_ids
+    targeting: frozenset  # Ids of the enemies targeting the scout
+
+    def matches(self, other: FieldInputs, epsilon: float) -> bool:
+        """Returns if the field computed from other can be used for these inputs"""
+        return (self.scout_tile == other.scout_tile
+                and self.target_region == other.target_region
+                and self.attract_points == other.attract_points
+                and self.forward == other.forward
+                and self.enemy_ids == other.enemy_ids
+                and self.targeting == other.targeting
+                and (not len(self.enemy_ids)
+                     or np.abs(self.enemy_positions - other.enemy_positions).max() <= epsilon))
+
+
+def field_inputs(scout: PFscout, scout_unit: PyUnit, enemies: Iterable[PyUnit]) -> FieldInputs:
+    """Returns the inputs of the field of the scout with the enemies around it"""
+    enemies = sorted(enemies, key=lambda enemy: enemy.id)
+    tile = scout_unit.tile_position
+    return FieldInputs(
+        scout_tile=(tile.x, tile.y),
+        target_region=scout.target_region.id if scout.target_region else 0,
+        attract_points=frozenset((point.x, point.y) for point in scout.attract_points),
+        forward=scout.forward,
+        enemy_ids=tuple(enemy.id for enemy in enemies),
+        enemy_positions=np.array([(enemy.position.x, enemy.position.y) for enemy in enemies]).reshape(-1, 2),
+        targeting=frozenset(enemy.id for enemy in enemies if enemy.can_attack and enemy.get_target() == scout_unit),
+    )
+
+
+class FieldCache:
+    """The last field result of a scout and the inputs it was computed from, with counters of the frames that
+    recomputed and reused it"""
+
+    def __init__(self, epsilon: float = FIELD_CACHE_EPSILON):
+        self.epsilon = epsilon
+        self.inputs: FieldInputs = None
+        self.value: Any = None
+        self.recomputed = 0
+        self.reused = 0
+
+    def get(self, inputs: FieldInputs) -> Any:
+        """Returns the stored result if it was computed from matching inputs, otherwise None"""
+        if self.inputs is not None and inputs.matches(self.inputs, self.epsilon):
+            self.reused += 1
+            return self.value
+        return None
+
+    def put(self, inputs: FieldInputs, value: Any):
+        self.recomputed += 1
+        self.inputs = inputs
+        self.value = value
+
+    def invalidate(self):
+        self.inputs = None
+        self.value = None
+
+    @property
+    def reuse_ratio(self) -> float:
+        """Share of the frames that reused the field"""
+        total = self.recomputed + self.reused
+        return self.reused / total if total else 0.0
@@ -1,6 +1,7 @@
 from __future__ import annotations
 import math
 from typing import TYPE_CHECKING
+import numpy as np
 from library import Point2D
 from modules.potential_flow.vector import Vector
 
@@ -137,3 +138,150 @@ def obstacle_source_potential(scout, p, c, a2):
     vy = -a2 * (a2 * y - 2 * x * y * xc - y2 * yc + x2 * yc) / deno
 
     return Vector(vx, vy)
+
+
+# ----------------- BATCHED ----------------- #
+# The functions below mirror the ones above but take arrays whose last axis holds (x, y). All inputs broadcast
+# against each other, so N evaluation points can be combined with M sources in a single pass by giving the points
+# shape (N, 1, 2) and the sources shape (1, M, 2). Coincident source and point give a zero contribution.
+
+
+def _inverse_r2(x, y):
+    r2 = x * x + y * y
+    return 1.0 / np.where(r2 == 0, np.inf, r2)
+
+
+def source_potential_batch(source, point):
+    """S(z) = log(z-z_s)"""
+    x = point[..., 0] - source[..., 0]
+    y = point[..., 1] - source[..., 1]
+    inv_r2 = _inverse_r2(x, y)
+    return np.stack((x * inv_r2, y * inv_r2), axis=-1)
+
+
+def vortex_potential_batch(source, point):
+    """V(z) = ilog(z-z_start)"""
+    x = point[..., 0] - source[..., 0]
+    y = point[..., 1] - source[..., 1]
+    inv_r2 = _inverse_r2(x, y)
+    return np.stack((y * inv_r2, -x * inv_r2), axis=-1)
+
+
+def needle_pval_batch(source, point, target, bias):
+    """Like source/sink potential but the shape change to a direction"""
+    x = point[..., 0] - source[..., 0]
+    y = point[..., 1] - source[..., 1]
+    vx = target[..., 0] - source[..., 0]
+    vy = target[..., 1] - source[..., 1]
+    inv_r2 = _inverse_r2(x, y)
+
+    v_len = np.hypot(vx, vy)
+    p_len = np.hypot(x, y)
+    norm = v_len * p_len
+    safe_norm = np.where(norm == 0, 1.0, norm)
+    cost = np.where(norm == 0, 0.0, (vx * x + vy * y) / safe_norm)
+    sint = np.where(norm == 0, 0.0, (vx * y - vy * x) / safe_norm)
+
+    cosn = 1.0 / bias
+    sinn = np.sqrt(np.clip(1 - cosn * cosn, 0.0, None))
+    scale = np.where(cost >= cosn, 1.0 / (cosn * cost + sinn * np.abs(sint)), 1.0)
+    scale = np.where(v_len == 0, 0.0, scale)
+    return np.stack((x * inv_r2 * scale, y * inv_r2 * scale), axis=-1)
+
+
+def obstacle_vortex_potential_batch(obs_pos, pos, center, a2):
+    """Circle theorem obstacle by a vortex O(z) = -ilog(a^2/(z-Z)-conj(z_c-Z))"""
+    x = pos[..., 0] - obs_pos[..., 0]
+    y = pos[..., 1] - obs_pos[..., 1]
+    xc = center[..., 0] - obs_pos[..., 0]
+    yc = center[..., 1] - obs_pos[..., 1]
+    x2 = x * x
+    y2 = y * y
+    r2 = x2 + y2
+    deno = r2 * (a2 * a2 - 2 * a2 * (x * xc + y * yc) + r2 * (xc * xc + yc * yc))
+    inv_deno = 1.0 / np.where(deno == 0, np.inf, deno)
+    vx = a2 * (a2 * y - 2 * x * y * xc - y2 * yc + x2 * yc) * inv_deno
+    vy = -a2 * (a2 * x - 2 * x * y * yc - x2 * xc + y2 * xc) * inv_deno
+    return np.stack((vx, vy), axis=-1)
+
+
+def obstacle_source_potential_batch(obs_pos, pos, center, a2):
+    """O(z) = log(a^2/(z-Z)-conj(z_c-Z))"""
+    x = pos[..., 0] - obs_pos[..., 0]
+    y = pos[..., 1] - obs_pos[..., 1]
+    xc = center[..., 0] - obs_pos[..., 0]
+    yc = center[..., 1] - obs_pos[..., 1]
+    x2 = x * x
+    y2 = y * y
+    r2 = x2 + y2
+    deno = r2 * (a2 * a2 - 2 * a2 * (x * xc + y * yc) + r2 * (xc * xc + yc * yc))
+    inv_deno = 1.0 / np.where(deno == 0, np.inf, deno)
+    vx = -a2 * (a2 * x - 2 * x * y * yc - x2 * xc + y2 * xc) * inv_deno
+    vy = -a2 * (a2 * y - 2 * x * y * xc - y2 * yc + x2 * yc) * inv_deno
+    return np.stack((vx, vy), axis=-1)
+
+
+def obstacle_potential_batch(scout: PFscout, obs_pos, pos, center, a2):
+    """Obstacle potential flow, see obstacle_potential"""
+    Ov = obstacle_vortex_potential_batch(obs_pos, pos, center, a2)
+    Os = obstacle_source_potential_batch(obs_pos, pos, center, a2)
+    return obstacle_pf_batch(scout, Ov, Os, pos, center)
+
+
+def obstacle_pf_batch(scout: PFscout, Ov, Os, pos, center):
+    """Combines obstacle vortex and source flows, summed over any number of obstacles, like obstacle_potential"""
+    d2 = (center[..., 0] - pos[..., 0]) ** 2 + (center[..., 1] - pos[..., 1]) ** 2
+    sign = np.where(d2 < scout.DISTANCE_TO_SWITCH_SOURCE_SINK, 1.0, -1.0)
+    return Ov * (scout.CENTER_VORTEX * 1.2) + Os * (sign * scout.CENTER_SOURCE_SINK * 1.2)[..., None]
+
+
+def line_source_potential_batch(start, end, weight, point, radius=None):
+    """
+    Source of total strength weight spread evenly along the segment start-end, i.e. source_potential integrated
+    over the segment in closed form. With radius given, only the part of the segment closer than radius to the
+    point is integrated. A segment of zero length acts as a point source of strength weight.
+
+    In the segment's frame, with a the distance along it and h across it from start to the point:
+    S(z) = λ(½log(r₀²/r₁²) ê + (θ₁ - θ₀) n̂), r and θ taken from the point to the ends of the segment.
+    """
+    dx = end[..., 0] - start[..., 0]
+    dy = end[..., 1] - start[..., 1]
+    length = np.hypot(dx, dy)
+    is_point = length == 0
+    safe_length = np.where(is_point, 1.0, length)
+    ex = np.where(is_point, 1.0, dx / safe_length)
+    ey = np.where(is_point, 0.0, dy / safe_length)
+
+    px = point[..., 0] - start[..., 0]
+    py = point[..., 1] - start[..., 1]
+    a = px * ex + py * ey
+    h = py * ex - px * ey
+
+    t0 = np.zeros_like(a)
+    t1 = np.broadcast_to(length, a.shape)
+    inside = np.ones(a.shape, dtype=bool)
+    if radius is not None:
+        reach2 = radius * radius - h * h
+        reach = np.sqrt(np.clip(reach2, 0.0, None))
+        t0 = np.clip(a - reach, 0.0, length)
+        t1 = np.clip(a + reach, 0.0, length)
+        inside = (reach2 > 0) & ((t1 > t0) | is_point & (a * a < reach2))
+
+    a0 = a - t0
+    a1 = a - t1
+    r0 = a0 * a0 + h * h
+    r1 = a1 * a1 + h * h
+    density = weight / safe_length
+    along = 0.5 * np.log(np.where(r0 == 0, 1.0, r0) / np.where(r1 == 0, 1.0, r1)) * density
+    across = (np.arctan2(h, a1) - np.arctan2(h, a0)) * density
+
+    inv_r2 = _inverse_r2(px, py)
+    vx = np.where(is_point, px * inv_r2 * weight, along * ex - across * ey)
+    vy = np.where(is_point, py * inv_r2 * weight, along * ey + across * ex)
+    return np.stack((vx, vy), axis=-1) * inside[..., None]
+
+
+def line_vortex_potential_batch(start, end, weight, point, radius=None):
+    """Vortex spread evenly along the segment start-end, vortex_potential integrated like in line_source_potential"""
+    source = line_source_potential_batch(start, end, weight, point, radius)
+    return np.stack((source[..., 1], -source[..., 0]), axis=-1)
@@ -0,0 +1,187 @@
+"""
+Barnes-Hut approximation of the summed obstacle flows of many units.
+
+The obstacles are put in a quadtree, every node knowing how many obstacles are below it, their mean squared radius,
+their centroid weighted by the squared radius and the radius of the circle around the centroid that holds them all.
+A node far enough from a point is evaluated as that many copies of a mean obstacle at its centroid instead of
+obstacle by obstacle. The flow of an obstacle is about linear in its squared radius far from it, so weighting the
+centroid cancels the first order error and the relative error of a node of radius s at distance d is about
+(s / (d - s))². The circle theorem mirrors the obstacle in the region center, so d is the distance from the centroid
+to the point or to the region center, whichever is closer. A node is accepted when that error is at most the
+tolerance. Nodes that are too close are opened, down to the leaves, whose obstacles are evaluated exactly.
+
+The traversal is done for all points at once, as a list of (point, node) pairs per level of the tree.
+"""
+from __future__ import annotations
+import time
+
+import numpy as np
+
+from modules.potential_flow.flows import obstacle_source_potential_batch, obstacle_vortex_potential_batch
+
+LEAF_SIZE = 4  # Nodes with at most this many obstacles are never approximated
+MAX_DEPTH = 10  # Levels below the root, obstacles that still share a node at this level are evaluated exactly
+MULTIPOLE_MIN_SOURCES = 32  # Below this many obstacles the exact sum is cheaper than building a tree
+
+
+class ObstacleTree:
+    """Quadtree over obstacles, stored level by level as arrays of nodes sorted by Morton code"""
+
+    def __init__(self, positions: np.ndarray, a2: np.ndarray, leaf_size: int = LEAF_SIZE, max_depth: int = MAX_DEPTH):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        a2 = np.asarray(a2, dtype=float)
+        self.leaf_size = leaf_size
+
+        low = positions.min(axis=0) if len(positions) else np.zeros(2)
+        extent = max(float((positions.max(axis=0) - low).max()) if len(positions) else 0.0, 1e-9)
+        cells = np.minimum((positions - low) / extent * (1 << max_depth), (1 << max_depth) - 1).astype(np.int64)
+        codes = morton_code(cells[:, 0], cells[:, 1], max_depth)
+        order = np.argsort(codes, kind="stable")
+        self.positions = positions[order]
+        self.a2 = a2[order]
+        codes = codes[order]
+
+        # Per level: the first obstacle of each node and its aggregates, plus the range of its children
+        self.levels: list[dict[str, np.ndarray]] = []
+        for depth in range(max_depth + 1):
+            keys = codes >> (2 * (max_depth - depth))
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            counts = np.diff(np.r_[starts, len(keys)])
+            weight = np.add.reduceat(self.a2, starts) if len(starts) else np.zeros(0)
+            centroid = np.add.reduceat(self.positions * self.a2[:, None], starts) / weight[:, None] \
+                if len(starts) else np.zeros((0, 2))
+            spread = np.hypot(*(self.positions - np.repeat(centroid, counts, axis=0)).T)
+            radius = np.maximum.reduceat(spread, starts) if len(starts) else np.zeros(0)
+            self.levels.append(dict(key=keys[starts], start=starts, count=counts, a2=weight / counts,
+                                    centroid=centroid, radius=radius))
+            if counts.max(initial=0) <= leaf_size:
+                break
+
+        for parent, child in zip(self.levels, self.levels[1:]):
+            parent_of_child = child["key"] >> 2
+            parent["child_start"] = np.searchsorted(parent_of_child, parent["key"], side="left")
+            parent["child_end"] = np.searchsorted(parent_of_child, parent["key"], side="right")
+
+    def __len__(self):
+        return len(self.positions)
+
+    def flows(self, points: np.ndarray, centers: np.ndarray, tolerance: float):
+        """
+        Returns the summed unit obstacle vortex and source flows of all obstacles at the (N, 2) points, each of
+        shape (N, 2), centers being the center of the region of each point.
+        """
+        n = len(points)
+        vortex = np.zeros((n, 2))
+        source = np.zeros((n, 2))
+        if not len(self.positions):
+            return vortex, source
+
+        point_idx = np.arange(n)
+        node_idx = np.zeros(n, dtype=int)
+        for depth, level in enumerate(self.levels):
+            pos = points[point_idx]
+            centroid = level["centroid"][node_idx]
+            radius = level["radius"][node_idx]
+            count = level["count"][node_idx]
+            center = centers[point_idx]
+            d = np.minimum(np.hypot(pos[:, 0] - centroid[:, 0], pos[:, 1] - centroid[:, 1]),
+                           np.hypot(center[:, 0] - centroid[:, 0], center[:, 1] - centroid[:, 1]))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                accept = (count > self.leaf_size) & (d > radius) & ((radius / (d - radius)) ** 2 <= tolerance)
+            is_last = depth == len(self.levels) - 1
+            exact = ~accept & ((count <= self.leaf_size) | is_last)
+            opened = ~accept & ~exact
+
+            if accept.any():
+                add_flows(vortex, source, point_idx[accept], centroid[accept], pos[accept], center[accept],
+                          level["a2"][node_idx[accept]], count[accept])
+            if exact.any():
+                sources, owners = self._expand(level["start"][node_idx[exact]], count[exact], point_idx[exact])
+                add_flows(vortex, source, owners, self.positions[sources], points[owners], centers[owners],
+                          self.a2[sources])
+            if not opened.any():
+                break
+            first = level["child_start"][node_idx[opened]]
+            children, point_idx = self._expand(first, level["child_end"][node_idx[opened]] - first,
+                                               point_idx[opened])
+            node_idx = children
+        return vortex, source
+
+    @staticmethod
+    def _expand(first: np.ndarray, count: np.ndarray, owner: np.ndarray):
+        """Turns the ranges first[i]:first[i] + count[i] into a flat index array and the owner of each index"""
+        total = int(count.sum())
+        offsets = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+        return np.repeat(first, count) + offsets, np.repeat(owner, count)
+
+
+def add_flows(vortex: np.ndarray, source: np.ndarray, owners: np.ndarray, obs_pos: np.ndarray, pos: np.ndarray,
+              center: np.ndarray, a2: np.ndarray, copies: np.ndarray = None):
+    """Adds the obstacle flows of (obstacle, point) pairs to the rows of their points, each counted copies times"""
+    n = len(vortex)
+    ov = obstacle_vortex_potential_batch(obs_pos, pos, center, a2)
+    os = obstacle_source_potential_batch(obs_pos, pos, center, a2)
+    if copies is not None:
+        ov *= copies[:, None]
+        os *= copies[:, None]
+    for axis in range(2):
+        vortex[:, axis] += np.bincount(owners, weights=ov[:, axis], minlength=n)
+        source[:, axis] += np.bincount(owners, weights=os[:, axis], minlength=n)
+
+
+def morton_code(x: np.ndarray, y: np.ndarray, bits: int) -> np.ndarray:
+    """Interleaves the bits of x and y, so that cells sharing a quadtree node are consecutive when sorted"""
+    code = np.zeros(len(x), dtype=np.int64)
+    for bit in range(bits):
+        code |= ((x >> bit) & 1) << (2 * bit)
+        code |= ((y >> bit) & 1) << (2 * bit + 1)
+    return code
+
+
+def exact_flows(positions: np.ndarray, a2: np.ndarray, points: np.ndarray, centers: np.ndarray):
+    """The summed obstacle flows without approximation, what ObstacleTree.flows approximates"""
+    ov = obstacle_vortex_potential_batch(positions[None], points[:, None], centers[:, None], a2[None])
+    os = obstacle_source_potential_batch(positions[None], points[:, None], centers[:, None], a2[None])
+    return ov.sum(axis=1), os.sum(axis=1)
+
+
+def benchmark(source_counts=(50, 200, 1000), point_counts=(1, 1000), tolerances=(1e-3, 1e-2, 1e-1),
+              repeat: int = 5, seed: int = 0) -> list[dict]:
+    """
+    Compares ObstacleTree.flows with the exact sum on clustered obstacles, like the buildings of a few bases.
+    Returns a row per case with the mean time of both, including building the tree, and the relative error of the
+    approximation (norm of the error over the norm of the exact vortex + source flow, median and max over points).
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n_sources in source_counts:
+        bases = rng.uniform(20, 130, (6, 2))
+        positions = bases[rng.integers(0, len(bases), n_sources)] + rng.normal(0, 5, (n_sources, 2))
+        a2 = rng.uniform(0.5, 2.75, n_sources) ** 2
+        for n_points in point_counts:
+            points = rng.uniform(10, 140, (n_points, 2))
+            centers = np.repeat(rng.uniform(20, 130, (1, 2)), n_points, axis=0)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                exact = exact_flows(positions, a2, points, centers)
+            exact_time = (time.perf_counter() - start) / repeat
+            exact_norm = np.hypot(*(exact[0] + exact[1]).T)
+
+            for tolerance in tolerances:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    approx = ObstacleTree(positions, a2).flows(points, centers, tolerance)
+                tree_time = (time.perf_counter() - start) / repeat
+                error = np.hypot(*(approx[0] + approx[1] - exact[0] - exact[1]).T) / np.maximum(exact_norm, 1e-12)
+                rows.append(dict(sources=n_sources, points=n_points, tolerance=tolerance, exact_ms=exact_time * 1e3,
+                                 tree_ms=tree_time * 1e3, median_error=float(np.median(error)),
+                                 max_error=float(error.max())))
+    return rows
+
+
+if __name__ == "__main__":
+    print(f"{'sources':>8} {'points':>7} {'tolerance':>9} {'exact ms':>9} {'tree ms':>9} {'median err':>11} {'max err':>9}")
+    for row in benchmark():
+        print(f"{row['sources']:>8} {row['points']:>7} {row['tolerance']:>9g} {row['exact_ms']:>9.3f} "
+              f"{row['tree_ms']:>9.3f} {row['median_error']:>11.2e} {row['max_error']:>9.2e}")
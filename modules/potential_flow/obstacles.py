@@ -0,0 +1,168 @@
+"""
+Incrementally maintained field of the static obstacles around the scout.
+
+Enemy buildings that cannot attack never move, yet unit_pval evaluates an obstacle_potential for each of them every
+frame. ObstacleField adds the flow of such an obstacle to the tiles that can see it once, when it is first seen, and
+subtracts it again when it dies, leaves the vision or changes type. calculate_pval then only evaluates the remaining
+units live.
+
+A scout in a tile sees the units in the tiles within a Chebyshev distance of it, except for its own tile, see
+get_enemies_in_neighbouring_tiles. Every tile therefore has its own set of obstacles and its own region center, so
+each tile keeps its own (resolution + 1) x (resolution + 1) block of samples covering it edge to edge, and a lookup
+interpolates within the block of the scout's tile only.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterable, NamedTuple
+
+import numpy as np
+
+from modules.potential_flow.flows import (
+    obstacle_pf_batch,
+    obstacle_source_potential_batch,
+    obstacle_vortex_potential_batch,
+)
+from modules.scout_helper import is_building, is_indestructable
+
+if TYPE_CHECKING:
+    from modules.py_unit import PyUnit
+    from modules.potential_flow.regions import RegionManager
+    from tasks.pf_scout import PFscout
+
+OBSTACLE_RESOLUTION = 2  # Sample intervals per tile side
+
+
+class Obstacle(NamedTuple):
+    position: tuple[float, float]
+    a2: float
+    unit_typeid: object  # A changed type, e.g. a lifted off building, means the obstacle must be checked again
+
+
+def is_static_obstacle(enemy: PyUnit) -> bool:
+    """Returns if unit_pval treats the enemy as an obstacle whatever the scout does"""
+    enemy_type = enemy.unit_type
+    return (is_indestructable(enemy_type) or is_building(enemy, enemy_type)) and not enemy.can_attack
+
+
+class ObstacleField:
+    """
+    Sums of the unit obstacle vortex and source flows of the static obstacles each tile sees, stored as float32
+    arrays indexed [tile y, tile x, sample y, sample x, component], and the number of obstacles each tile sees.
+    The scout's constants are applied at lookup, so reset_constants and reverse_flows never invalidate the field.
+    """
+
+    def __init__(self, region_manager: RegionManager, resolution: int = OBSTACLE_RESOLUTION):
+        self.resolution = resolution
+        self.labels = region_manager.tile_labels
+        self.centers = np.zeros((max(region_manager.region_by_id) + 1, 2))
+        for region_id, region in region_manager.region_by_id.items():
+            self.centers[region_id] = region.center.x, region.center.y
+
+        steps = np.arange(resolution + 1) / resolution
+        self.offsets = np.stack(np.meshgrid(steps, steps), axis=-1)  # [sample y, sample x] -> (x, y) in the tile
+        shape = self.labels.shape + (resolution + 1, resolution + 1, 2)
+        self.vortex = np.zeros(shape, dtype=np.float32)
+        self.source = np.zeros(shape, dtype=np.float32)
+        self.count = np.zeros(self.labels.shape, dtype=np.int32)
+        self.obstacles: dict[int, Obstacle] = {}
+        self.distance = None
+
+    def __contains__(self, enemy: PyUnit) -> bool:
+        return enemy.id in self.obstacles
+
+    def __len__(self):
+        return len(self.obstacles)
+
+    def memory_usage(self) -> int:
+        """Returns the number of bytes taken by the sampled fields"""
+        return self.vortex.nbytes + self.source.nbytes + self.count.nbytes
+
+    def clear(self):
+        self.vortex[:] = 0
+        self.source[:] = 0
+        self.count[:] = 0
+        self.obstacles.clear()
+
+    def sync(self, enemies: Iterable[PyUnit], distance: int):
+        """
+        Adds the static obstacles among enemies that are not in the field yet and removes the ones that are no
+        longer among them or have changed type.
+        :param distance: Chebyshev distance in tiles within which the scout sees units.
+        """
+        if distance != self.distance:
+            self.clear()
+            self.distance = distance
+
+        seen = set()
+        for enemy in enemies:
+            seen.add(enemy.id)
+            obstacle = self.obstacles.get(enemy.id)
+            if obstacle is not None:
+                if obstacle.unit_typeid == enemy.unit_type.unit_typeid:
+                    continue
+                self.remove(enemy.id)
+            if is_static_obstacle(enemy):
+                self.add(enemy)
+
+        for unit_id in self.obstacles.keys() - seen:
+            self.remove(unit_id)
+
+    def add(self, enemy: PyUnit):
+        obstacle = Obstacle((enemy.position.x, enemy.position.y), enemy.radius * enemy.radius,
+                            enemy.unit_type.unit_typeid)
+        self.obstacles[enemy.id] = obstacle
+        self._apply(obstacle, 1)
+
+    def remove(self, unit_id: int):
+        self._apply(self.obstacles.pop(unit_id), -1)
+
+    def _apply(self, obstacle: Obstacle, sign: int):
+        """Adds (sign 1) or subtracts (sign -1) the flows of the obstacle in the tiles that see it"""
+        height, width = self.labels.shape
+        tile_x = int(np.floor(obstacle.position[0]))
+        tile_y = int(np.floor(obstacle.position[1]))
+        d = self.distance
+        tiles_y, tiles_x = np.mgrid[max(tile_y - d, 0):min(tile_y + d + 1, height),
+                                    max(tile_x - d, 0):min(tile_x + d + 1, width)]
+        sees = (self.labels[tiles_y, tiles_x] > 0) & ((tiles_x != tile_x) | (tiles_y != tile_y))
+        ys = tiles_y[sees]
+        xs = tiles_x[sees]
+
+        position = np.array(obstacle.position)
+        points = np.stack((xs, ys), axis=-1)[:, None, None, :] + self.offsets  # (K, r + 1, r + 1, 2)
+        centers = self.centers[self.labels[ys, xs]][:, None, None, :]
+        self.vortex[ys, xs] += sign * obstacle_vortex_potential_batch(position, points, centers, obstacle.a2)
+        self.source[ys, xs] += sign * obstacle_source_potential_batch(position, points, centers, obstacle.a2)
+        self.count[ys, xs] += sign
+        if sign < 0:
+            # Clear the rounding left behind where the last obstacle was removed
+            empty = self.count[ys, xs] == 0
+            self.vortex[ys[empty], xs[empty]] = 0
+            self.source[ys[empty], xs[empty]] = 0
+
+    def pval(self, scout: PFscout, x: float, y: float) -> tuple[np.ndarray, int] | None:
+        """
+        Returns the summed obstacle_potential of the static obstacles a scout at (x, y) sees and how many they are.
+        None if (x, y) is outside of every region.
+        """
+        tile_x = int(np.floor(x))
+        tile_y = int(np.floor(y))
+        if not (0 <= tile_y < self.labels.shape[0] and 0 <= tile_x < self.labels.shape[1]):
+            return None
+        label = self.labels[tile_y, tile_x]
+        if not label:
+            return None
+        count = int(self.count[tile_y, tile_x])
+        if not count:
+            return np.zeros(2), 0
+
+        u = (x - tile_x) * self.resolution
+        v = (y - tile_y) * self.resolution
+        i = min(int(u), self.resolution - 1)
+        j = min(int(v), self.resolution - 1)
+        u -= i
+        v -= j
+        weights = np.array([[(1 - u) * (1 - v), u * (1 - v)], [(1 - u) * v, u * v]])[..., None]
+        vortex = (self.vortex[tile_y, tile_x, j:j + 2, i:i + 2] * weights).sum(axis=(0, 1))
+        source = (self.source[tile_y, tile_x, j:j + 2, i:i + 2] * weights).sum(axis=(0, 1))
+
+        return obstacle_pf_batch(scout, vortex, source, np.array([x, y]), self.centers[label]), count
@@ -1,11 +1,9 @@
 from __future__ import annotations
-import math
-from typing import TYPE_CHECKING
-from library import Color, Point2D, Point2DI, UNIT_TYPEID
+from typing import TYPE_CHECKING, Iterable, NamedTuple
+import numpy as np
+from library import Color, PLAYER_ENEMY, Point2D, UNIT_TYPEID
 from config import DEBUG_SCOUT, OLD_ENEMIES_ENABLED
 from modules.extra import (
-    get_closest,
-    get_enemies_in_neighbouring_tiles,
     get_enemies_in_radius,
 )
 from config import DEBUG_SCOUT
@@ -16,12 +14,22 @@ OFF = 0
 EXTEND = 1
 
 from modules.potential_flow.flows import (
+    SCALE,
     enemy_pf,
+    line_source_potential_batch,
+    line_vortex_potential_batch,
+    needle_pval_batch,
+    obstacle_pf_batch,
     obstacle_potential,
+    obstacle_potential_batch,
     region_pf,
     source_potential,
+    source_potential_batch,
     vortex_potential,
+    vortex_potential_batch,
 )
+from modules.potential_flow.atlas import BORDER_SOURCE, BORDER_VORTEX, REGION_SOURCE, REGION_VORTEX
+from modules.potential_flow.multipole import MULTIPOLE_MIN_SOURCES, ObstacleTree
 from modules.potential_flow.regions import Region
 from modules.potential_flow.vector import Vector
 from modules.scout_helper import *
@@ -31,8 +39,11 @@ from modules.py_unit import PyUnit
 if TYPE_CHECKING:
     from tasks.pf_scout import PFscout
 
-def region_pval(scout: PFscout, scout_unit: PyUnit, target_region: Region) -> Vector:
-    """Start from center of the region and the combine of source and vortex potential flow"""
+def region_pval(scout: PFscout, scout_unit: PyUnit, target_region: Region, sample: np.ndarray = None) -> Vector:
+    """
+    Start from center of the region and the combine of source and vortex potential flow
+    sample is the scout's atlas lookup, when given the flows are taken from it instead of being calculated.
+    """
     cur_reg = scout.agent.region_manager.get_region(scout_unit.tile_position)
     d2_center = cur_reg.center.distance(scout_unit.position)
 
@@ -65,6 +76,11 @@ def region_pval(scout: PFscout, scout_unit: PyUnit, target_region: Region) -> Ve
             else -_src_potential
         )
 
+    if sample is not None:
+        p1Vz = Vector(*sample[REGION_VORTEX].tolist()) * scout.CENTER_VORTEX * vortex_correction
+        p2Sz = Vector(*sample[REGION_SOURCE].tolist()) * scout.CENTER_SOURCE_SINK * source_correction
+        return p1Vz + p2Sz if d2_center < scout.DISTANCE_TO_SWITCH_SOURCE_SINK else p1Vz - p2Sz
+
     return region_pf(
         cur_reg.center,
         scout_unit.position,
@@ -82,34 +98,41 @@ def border_pval(
     cur_region: Region,
     target_reg: Region,
     is_different_region: bool,
+    sample: np.ndarray = None,
 ):
-    detail_border: frozenset[Point2DI] = cur_region.border
     scout_position = scout_unit.position
 
-    border_co = len(detail_border) / (math.pi * 14)
-    scout.DISTANCE_TO_ACTIVE_BORDER_FLOW = max(border_co, 3)
+    scout.DISTANCE_TO_ACTIVE_BORDER_FLOW = cur_region.active_border_distance
+    if sample is not None:
+        # The atlas already turned the border off near chokepoints and the source outside of the target region
+        return (Vector(*sample[BORDER_VORTEX].tolist()) * scout.BORDER_VORTEX).iadd_scaled(
+            Vector(*sample[BORDER_SOURCE].tolist()), scout.BORDER_SOURCE)
     src_correction = (1 if scout.agent.region_manager.get_region(scout_unit.tile_position) == target_reg else 0)
-    chokepoint = get_closest(scout.agent.region_manager.chokepoints_as_centers, scout_position)
+    chokepoint = scout.agent.region_manager.chokepoint_index.nearest(scout_position).center
     inactive_border = (scout_position.distance(chokepoint) < scout.DISTANCE_TO_ACTIVE_BORDER_FLOW + 4)
+    if is_different_region and inactive_border:
+        return Vector()
 
-    num_border = 0
-    border_pval = Vector()
-
-    for border_tile in detail_border:
-        if scout_position.distance(border_tile) < scout.DISTANCE_TO_ACTIVE_BORDER_FLOW:
-            if is_different_region and inactive_border:
-                continue
-
-            vrtx_pval = vortex_potential(border_tile, scout_position) * scout.BORDER_VORTEX
-            src = (
-                source_potential(border_tile, scout_position)
-                * scout.BORDER_SOURCE
-                * src_correction
-            )
+    pos = np.array([scout_position.x, scout_position.y])
+    if scout.USE_BORDER_SEGMENTS:
+        # Line vortices and sources along the border segments, clipped to DISTANCE_TO_ACTIVE_BORDER_FLOW
+        start, end, weight = cur_region.border_segments
+        distance = scout.DISTANCE_TO_ACTIVE_BORDER_FLOW
+        border_pval = line_vortex_potential_batch(start, end, weight, pos, distance).sum(axis=0) * scout.BORDER_VORTEX
+        if src_correction:
+            border_pval += (line_source_potential_batch(start, end, weight, pos, distance).sum(axis=0)
+                            * scout.BORDER_SOURCE)
+        return Vector(float(border_pval[0]), float(border_pval[1]))
+
+    # Only the border tiles closer than DISTANCE_TO_ACTIVE_BORDER_FLOW take part
+    active_border = cur_region.border_index.query_radius(pos[0], pos[1], scout.DISTANCE_TO_ACTIVE_BORDER_FLOW)
+    if not len(active_border):
+        return Vector()
 
-            border_pval += vrtx_pval + src
-            num_border += 1
-    return border_pval
+    border_pval = vortex_potential_batch(active_border, pos).sum(axis=0) * scout.BORDER_VORTEX
+    if src_correction:
+        border_pval += source_potential_batch(active_border, pos).sum(axis=0) * scout.BORDER_SOURCE
+    return Vector(float(border_pval[0]), float(border_pval[1]))
 
 
 def attract_point_pval(scout: PFscout, scout_unit: PyUnit):
@@ -119,7 +142,7 @@ def attract_point_pval(scout: PFscout, scout_unit: PyUnit):
         if scout.attract_points is None:
             scout.attract_points.add(scout.agent.region_manager.get_region(scout_unit.tile_position).center)
     for point in scout.attract_points:
-        pval += source_potential(point, pos) * (-TILE_SIZE)
+        pval.iadd_scaled(source_potential(point, pos), -TILE_SIZE)
     return pval
 
 
@@ -163,45 +186,178 @@ def unit_pval(scout: PFscout, enemy: PyUnit, scout_unit: PyUnit):
     return obstacle_potential(scout, enemy.position, scout_pos, center, enemy_radius * enemy_radius)
 
 
-def calculate_pval(scout: PFscout, scout_unit: PyUnit):
-    cur_region = scout.agent.region_manager.get_region(scout_unit.tile_position)
+class UnitBatch(NamedTuple):
+    """Enemies packed into arrays so that their potentials can be evaluated in one pass, see pack_units"""
+    position: np.ndarray        # (M, 2)
+    a2: np.ndarray              # (M,) squared radius, used by the obstacle potential
+    is_static: np.ndarray       # (M,) indestructible or non-combat building, always an obstacle
+    is_attacker: np.ndarray     # (M,) can attack and aims at the scout or is not a worker
+    is_inert: np.ndarray        # (M,) non-combat unit that is flying or burrowed, emits nothing
+    engage_range: np.ndarray    # (M,) attacker only acts as such when closer than this
+    needle_bias: np.ndarray     # (M,) bias of the needle for attackers targeting the scout
+    source_strength: np.ndarray  # (M,) strength of the source for attackers not targeting the scout
+    hits_scout: np.ndarray      # (M,) the scout is the unit's target
+    is_targeting: np.ndarray    # (M,) see enemy_targeting_scout, added directly instead of averaged
+
+    def __len__(self):
+        return len(self.position)
+
+
+def pack_units(scout: PFscout, scout_unit: PyUnit, enemies) -> UnitBatch:
+    """Reads the attributes unit_pval branches on once per enemy and packs them into a UnitBatch"""
+    rows = []
+    for enemy in enemies:
+        enemy_type = enemy.unit_type
+        position = enemy.position
+        radius = enemy.radius
+        target = enemy.get_target() if enemy.can_attack else None
+        hits_scout = target == scout_unit
+        rows.append((
+            position.x,
+            position.y,
+            radius * radius,
+            is_indestructable(enemy_type) or is_building(enemy, enemy_type),
+            enemy.can_attack and (hits_scout or not enemy_type.is_worker),
+            not enemy_type.is_combat_unit and (enemy.is_flying or enemy.is_burrowed),
+            enemy_type.attack_range + 4,
+            (enemy_type.attack_range + 1) * 1.0 / radius,
+            scout.ENEMY_NEEDLE * (enemy_type.attack_range - 0.5) * (1.0 / radius),
+            hits_scout,
+            enemy_targeting_scout(enemy, scout_unit),
+        ))
+
+    data = np.array(rows, dtype=float).reshape(-1, 11)
+    return UnitBatch(
+        position=data[:, 0:2],
+        a2=data[:, 2],
+        is_static=data[:, 3].astype(bool),
+        is_attacker=data[:, 4].astype(bool),
+        is_inert=data[:, 5].astype(bool),
+        engage_range=data[:, 6],
+        needle_bias=data[:, 7],
+        source_strength=data[:, 8],
+        hits_scout=data[:, 9].astype(bool),
+        is_targeting=data[:, 10].astype(bool),
+    )
+
+
+def units_pval(scout: PFscout, units: UnitBatch, points: np.ndarray, centers: np.ndarray, visible: np.ndarray = None,
+               static_pval: np.ndarray = None, static_count: np.ndarray = None):
+    """
+    Vectorised unit_pval summed over all units, evaluated at N points at once.
+    points and centers have shape (N, 2), centers being the center of the region each point is in.
+    visible is an optional (N, M) mask of the units each point takes into account, all of them if None.
+    static_pval and static_count are the (N, 2) summed potential and (N,) number of obstacles already evaluated
+    elsewhere, see ObstacleField, which are averaged together with the obstacles among units.
+    Returns the unit part of the potential value and the enemy direction, both of shape (N, 2).
+    Like in calculate_pval, units targeting the scout are added as they are while the rest are averaged.
+    """
+    n = len(points)
+    if static_pval is None:
+        static_pval = np.zeros((n, 2))
+        static_count = np.zeros(n)
+    if not len(units):
+        return static_pval / np.maximum(static_count, 1)[:, None], np.zeros((n, 2))
+
+    pos = points[:, None, :]          # (N, 1, 2)
+    center = centers[:, None, :]      # (N, 1, 2)
+    enemy_pos = units.position[None]  # (1, M, 2)
+
+    dist = np.hypot(enemy_pos[..., 0] - pos[..., 0], enemy_pos[..., 1] - pos[..., 1])
+    attacking = ~units.is_static & units.is_attacker & (dist < units.engage_range)
+    inert = ~units.is_static & ~attacking & units.is_inert
+    obstacle = ~attacking & ~inert
+    if visible is None:
+        visible = np.ones(dist.shape, dtype=bool)
+    attacking &= visible
+    obstacle &= visible
+
+    targeting = units.is_targeting
+    # Obstacles for every point can be summed by a Barnes-Hut tree instead, when there are enough of them
+    in_tree = np.zeros(len(units), dtype=bool)
+    if scout.MULTIPOLE_TOLERANCE > 0:
+        in_tree = obstacle.all(axis=0) & ~targeting
+        if np.count_nonzero(in_tree) < MULTIPOLE_MIN_SOURCES:
+            in_tree[:] = False
+    if in_tree.any():
+        obstacle &= ~in_tree
+        tree = ObstacleTree(units.position[in_tree], units.a2[in_tree])
+        tree_vortex, tree_source = tree.flows(points, centers, scout.MULTIPOLE_TOLERANCE)
+        static_pval = static_pval + obstacle_pf_batch(scout, tree_vortex, tree_source, points, centers)
+
+    pval = np.zeros(dist.shape + (2,))
+    if obstacle.any():
+        pval += obstacle_potential_batch(scout, enemy_pos, pos, center, units.a2) * obstacle[..., None]
+    if attacking.any():
+        needle = scout.ENEMY_NEEDLE * SCALE * needle_pval_batch(enemy_pos, pos, pos, units.needle_bias)
+        source = source_potential_batch(enemy_pos, pos) * units.source_strength[:, None]
+        attack = np.where(units.hits_scout[:, None], needle, source)
+        pval += attack * attacking[..., None]
+
+    enemy_direction = pval[:, targeting].sum(axis=1)
+    obstacle_num = np.count_nonzero(visible[:, ~targeting], axis=1) + static_count
+    obstacle_val = (pval[:, ~targeting].sum(axis=1) + static_pval) / np.maximum(obstacle_num, 1)[:, None]
+    return enemy_direction + obstacle_val, enemy_direction
+
+
+def gather_enemies(scout: PFscout, scout_unit: PyUnit, reach: int = 0) -> set[PyUnit]:
+    """
+    Returns the enemies in the tiles the scout sees, which calculate_pval takes into account, and reach tiles further,
+    like get_enemies_in_neighbouring_tiles without building the set of tiles
+    """
+    return enemies_in_sight(scout_unit, scout.agent.unit_collection.get_group(PLAYER_ENEMY), reach)
 
-    next_vector = Vector() # the potential value:
 
-    enemy_direction = Vector()
-    enemy_num = 0
-    obstacle_val = Vector()
-    obstacle_num = 0
-    units = []
+def enemies_in_sight(scout_unit: PyUnit, enemies: Iterable[PyUnit], reach: int = 0) -> set[PyUnit]:
+    """The enemies among the given ones in the tiles the scout sees and reach tiles further, see gather_enemies"""
+    tile = scout_unit.tile_position
+    dist = int(scout_unit.unit_type.sight_range + 2) + reach
+    enemy_tiles = ((enemy, enemy.tile_position) for enemy in enemies)
+    return {enemy for enemy, enemy_tile in enemy_tiles
+            if 0 < max(abs(enemy_tile.x - tile.x), abs(enemy_tile.y - tile.y)) <= dist}
 
-    enemies = get_enemies_in_neighbouring_tiles(
-        scout.agent,
-        scout_unit.tile_position,
-        fast=False,
-        dist=scout_unit.unit_type.sight_range + 2,
-    )
+
+def calculate_pval(scout: PFscout, scout_unit: PyUnit, enemies: set[PyUnit] = None):
+    cur_region = scout.agent.region_manager.get_region(scout_unit.tile_position)
+    scout_pos = scout_unit.position
+
+    if enemies is None:
+        enemies = gather_enemies(scout, scout_unit)
     scout.enemies = enemies
 
-    # Calculate unitPVal
-    for enemy in scout.get_enemies():
-        enemy_pval = unit_pval(scout, enemy, scout_unit)
-        if enemy_targeting_scout(enemy, scout_unit):
-            enemy_direction += enemy_pval
-            enemy_num += 1
-            next_vector += enemy_pval
-        else:
-            # obstacle
-            obstacle_num += 1
-            obstacle_val += enemy_pval
-            if enemy_pval:
-                units.append(enemy_pval)
+    # Static obstacles come summed from the obstacle field, only the rest is evaluated here
+    live_enemies = scout.get_enemies()
+    static_pval = static_count = None
+    if scout.USE_OBSTACLE_FIELD:
+        obstacle_field = scout.obstacle_field
+        obstacle_field.sync(scout.agent.unit_collection.get_group(PLAYER_ENEMY),
+                            int(scout_unit.unit_type.sight_range + 2))
+        if static := obstacle_field.pval(scout, scout_pos.x, scout_pos.y):
+            static_pval = static[0][None]
+            static_count = np.array([static[1]])
+            live_enemies = [enemy for enemy in live_enemies if enemy not in obstacle_field]
+
+    # Calculate unitPVal for all enemies at once
+    units = pack_units(scout, scout_unit, live_enemies)
+    unit_val, enemy_val = units_pval(
+        scout,
+        units,
+        np.array([[scout_pos.x, scout_pos.y]]),
+        np.array([[cur_region.center.x, cur_region.center.y]]),
+        static_pval=static_pval,
+        static_count=static_count,
+    )
+    next_vector = Vector(float(unit_val[0, 0]), float(unit_val[0, 1]))  # the potential value
+    enemy_direction = Vector(float(enemy_val[0, 0]), float(enemy_val[0, 1]))
 
-    # Add back obstacle value after averaged
-    if obstacle_num:
-        next_vector += obstacle_val * (1.0 / obstacle_num)
+    # Region and border flows from the atlas, when enabled
+    sample = None
+    if scout.USE_ATLAS:
+        atlas = scout.agent.region_manager.atlas
+        sample = atlas.lookup(cur_region.id, cur_region == scout.target_region, scout_pos)
 
     # Calculate regionPVal
-    region_val = region_pval(scout, scout_unit, scout.target_region)
+    region_val = region_pval(scout, scout_unit, scout.target_region, sample)
     next_vector += region_val
 
     # Calculate borderPVal
@@ -211,6 +367,7 @@ def calculate_pval(scout: PFscout, scout_unit: PyUnit):
         cur_region,
         scout.target_region,
         cur_region != scout.target_region,
+        sample,
     )
     next_vector += curr_border_pval
 
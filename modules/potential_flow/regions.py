@@ -1,13 +1,25 @@
 from __future__ import annotations
+import math
 from typing import TYPE_CHECKING
 
+import numpy as np
 from library import Point2D, Point2DI, BaseLocation
 from functools import cached_property, cache
-from modules.extra import get_adjacent_neighbours, parse_json_objects, get_closest, get_neighbours_within_distance
+from modules.extra import parse_json_objects, get_closest
+from modules.map_bundle import load_or_build_many, source_files
+from config import DEBUG_CONSOLE
+from modules.potential_flow.atlas import PotentialAtlas
+from modules.path_finding.region_graph import RegionGraph
+from modules.spatial_index import GridIndex, PointIndex
 
 if TYPE_CHECKING:
     from agents.basic_agent import BasicAgent
 
+BORDER_CELL_SIZE = 4  # Side of the border index buckets, in tiles
+BORDER_SEGMENT_TOLERANCE = 1.0  # Max distance in tiles between a border tile and the segment replacing it
+# Neighbour offsets, the adjacent ones first so that chains prefer straight steps over diagonal ones
+CHAIN_OFFSETS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, 1), (1, -1), (-1, -1))
+
 
 class Region:
     def __init__(self, agent, tiles: set[Point2DI], mid_point: Point2DI):
@@ -18,24 +30,43 @@ class Region:
         self.tiles_as_tuples = {(pos.x, pos.y) for pos in tiles}
         # self.base_locations: list[BaseLocation] = []
 
-    def on_start(self, id=None):
+    def on_start(self, id=None, border_array: np.ndarray = None):
+        self.id = id
+        if border_array is not None:
+            self.border_array = border_array
         _ = self.border
+        _ = self.border_index
+        _ = self.border_segments
         _ = self.center
         _ = self.base_locations
-        self.id = id
 
     @cached_property
-    def border(self):
-        border = set()
-        for y in range(self.agent.map_tools.height):
-            for x in range(self.agent.map_tools.width):
-                tile = Point2DI(x, y)
-                if tile not in self.tiles:
-                    for neighbour in get_adjacent_neighbours(tile, self.agent):
-                        if neighbour in self.tiles:
-                            border.add(neighbour)
-
-        return frozenset(border)
+    def border(self) -> frozenset[Point2DI]:
+        """The tiles of the region with a side on a tile of the map outside of it"""
+        return frozenset(Point2DI(int(x), int(y)) for x, y in self.border_array)
+
+    @cached_property
+    def border_array(self) -> np.ndarray:
+        """The border tiles as a (B, 2) array of x and y, RegionManager gives it for all regions at once"""
+        mask = np.zeros((self.agent.map_tools.height, self.agent.map_tools.width), dtype=np.int16)
+        tiles = np.array(sorted(self.tiles_as_tuples), dtype=int).reshape(-1, 2)
+        mask[tiles[:, 1], tiles[:, 0]] = 1
+        return border_tiles(mask).get(1, np.zeros((0, 2)))
+
+    @cached_property
+    def border_index(self) -> GridIndex:
+        """Spatial index over the border tiles, for finding the tiles near a position"""
+        return GridIndex(self.border_array, BORDER_CELL_SIZE)
+
+    @cached_property
+    def border_segments(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The border fitted to straight segments, see fit_border_segments"""
+        return fit_border_segments({(tile.x, tile.y) for tile in self.border})
+
+    @cached_property
+    def active_border_distance(self) -> float:
+        """Distance within which the border takes part in border_pval, longer borders reach further"""
+        return max(len(self.border) / (math.pi * 14), 3)
 
     @cached_property
     def center(self) -> Point2D:
@@ -68,78 +99,264 @@ def calc_center(tiles: set[Point2DI]) -> Point2DI:
     return Point2D(x / len(tiles), y / len(tiles))
 
 
+def fit_border_segments(tiles: set[tuple[int, int]],
+                        tolerance: float = BORDER_SEGMENT_TOLERANCE) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fits border tiles to polylines of straight segments.
+    The tiles are chained into 8-connected paths, and every path is simplified with Douglas-Peucker.
+    Each segment is weighted by the number of tiles it replaces, so the weights sum to the number of tiles.
+    Returns the (S, 2) segment starts, the (S, 2) segment ends and the (S,) weights.
+    A lone tile becomes a segment of zero length.
+    """
+    starts, ends, weights = [], [], []
+    for chain, is_closed in chain_tiles(tiles):
+        points = np.array(chain + [chain[0]] if is_closed else chain, dtype=float)
+        kept = simplify_polyline(points, tolerance)
+        if len(kept) == 1:
+            starts.append(points[0])
+            ends.append(points[0])
+            weights.append(1)
+            continue
+        for i, j in zip(kept, kept[1:]):
+            starts.append(points[i])
+            ends.append(points[j])
+            weights.append(j - i)
+        if not is_closed:
+            weights[-1] += 1    # The last tile of an open chain is not the start of any segment
+
+    return (np.array(starts, dtype=float).reshape(-1, 2),
+            np.array(ends, dtype=float).reshape(-1, 2),
+            np.array(weights, dtype=float))
+
+
+def chain_tiles(tiles: set[tuple[int, int]]) -> list[tuple[list[tuple[int, int]], bool]]:
+    """
+    Orders tiles into chains of 8-connected tiles, every tile ending up in exactly one chain.
+    Chains start at the tile with the fewest neighbours and walk to adjacent tiles before diagonal ones.
+    Returns the chains and whether each one is closed, i.e. ends next to where it started.
+    """
+    remaining = set(tiles)
+
+    def neighbours(tile):
+        return [(tile[0] + dx, tile[1] + dy) for dx, dy in CHAIN_OFFSETS if (tile[0] + dx, tile[1] + dy) in remaining]
+
+    chains = []
+    while remaining:
+        current = min(remaining, key=lambda tile: (len(neighbours(tile)), tile))
+        remaining.remove(current)
+        chain = [current]
+        while next_tiles := neighbours(current):
+            # next_tiles is ordered adjacent first, min keeps that order between equally connected tiles
+            current = min(next_tiles, key=lambda tile: len(neighbours(tile)) + 8 * (next_tiles.index(tile) > 3))
+            remaining.remove(current)
+            chain.append(current)
+        is_closed = len(chain) > 2 and max(abs(chain[-1][0] - chain[0][0]), abs(chain[-1][1] - chain[0][1])) == 1
+        chains.append((chain, is_closed))
+    return chains
+
+
+def simplify_polyline(points: np.ndarray, tolerance: float) -> list[int]:
+    """Douglas-Peucker, returns the sorted indices of the points kept so that no point is further than tolerance"""
+    if len(points) < 3:
+        return list(range(len(points)))
+    kept = {0, len(points) - 1}
+    stack = [(0, len(points) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        segment = points[j] - points[i]
+        offsets = points[i + 1:j] - points[i]
+        length = np.hypot(*segment)
+        if length:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        else:   # Closed chain, first and last point are the same
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance:
+            kept.add(i + 1 + k)
+            stack.extend(((i, i + 1 + k), (i + 1 + k, j)))
+    return sorted(kept)
+
+
+def adjacent_to(mask: np.ndarray) -> np.ndarray:
+    """Returns the tiles with a side on a tile of mask"""
+    padded = np.pad(mask, 1)
+    height, width = mask.shape
+    adjacent = np.zeros(mask.shape, dtype=bool)
+    for dx, dy in CHAIN_OFFSETS[:4]:
+        adjacent |= padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+    return adjacent
+
+
+def border_tiles(labels: np.ndarray) -> dict[int, np.ndarray]:
+    """
+    Returns the border of every region of a label raster at once, the labelled tiles with a side on a tile of the map
+    with another label, as a (B, 2) array of x and y per label, sorted by y and then x
+    """
+    height, width = labels.shape
+    padded = np.pad(labels, 1, constant_values=-1)  # Outside of the map, which does not make a border
+    is_border = np.zeros(labels.shape, dtype=bool)
+    for dx, dy in CHAIN_OFFSETS[:4]:
+        neighbour = padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+        is_border |= (neighbour != labels) & (neighbour >= 0)
+    ys, xs = np.nonzero(is_border & (labels > 0))
+    ids = labels[ys, xs]
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order]
+    tiles = np.stack((xs[order], ys[order]), axis=-1).astype(float)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.zeros(0, dtype=int)
+    return {int(ids[start]): part for start, part in zip(starts, np.split(tiles, starts[1:]))}
+
+
+def dilate_labels(labels: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Multi-source breadth first search from every labelled tile at once, growing the labels one ring of 8 neighbours
+    per step until every tile of mask has one. Between labels reaching a tile in the same step, the neighbour first in
+    CHAIN_OFFSETS wins.
+    Returns the grown labels and the number of steps it took to reach each tile, which is the Chebyshev distance to
+    the closest labelled tile, -1 where no label reached.
+    """
+    height, width = labels.shape
+    nearest = labels.copy()
+    distance = np.where(labels > 0, 0, -1).astype(np.int32)
+    step = 0
+    while (mask & (nearest == 0)).any():
+        step += 1
+        padded = np.pad(nearest, 1)
+        grown = nearest.copy()
+        for dx, dy in CHAIN_OFFSETS:
+            neighbour = padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+            take = (grown == 0) & (neighbour > 0)
+            grown[take] = neighbour[take]
+        reached = (grown > 0) & (nearest == 0)
+        if not reached.any():
+            break   # The rest of mask has no labelled tile at all
+        distance[reached] = step
+        nearest = grown
+    return nearest, distance
+
+
 class RegionManager:
 
     def __init__(self, agent: BasicAgent):
         self.agent = agent
-        self.regions: set[Region] = {
-            Region.parse_json(self.agent, data)
-            for data in parse_json_objects("data/regions.json")
-        }
-        self.chokepoints: frozenset[Chokepoint] = frozenset(
-            Chokepoint.parse_json(data) for data in parse_json_objects("data/chokepoints.json"))
+        # Loaded in on_start, once the map is known
+        self.regions: set[Region] = set()
+        self.chokepoints: frozenset[Chokepoint] = frozenset()
+        self.chokepoints_as_centers: frozenset[Point2D] = frozenset()
+
+    def load(self):
+        """Reads the regions and chokepoints of the agent's map from its source files, see map_bundle.source_files"""
+        regions_file, chokepoints_file = source_files(self.agent.map_file)
+        self.regions = {Region.parse_json(self.agent, data) for data in parse_json_objects(regions_file)}
+        self.chokepoints = frozenset(Chokepoint.parse_json(data) for data in parse_json_objects(chokepoints_file))
         self.chokepoints_as_centers = frozenset(chokepoint.center
                                                 for chokepoint in self.chokepoints)
-        
+
     @cached_property
-    def terrain_borders(self):
-        border_tiles = set()
-        for y in range(self.agent.map_tools.height):
-            for x in range(self.agent.map_tools.width):
-                tile = Point2DI(x, y)
-                if self.agent.map_tools.is_walkable(tile):
-                    for neighbour in get_adjacent_neighbours(tile, self.agent):
-                        if not self.agent.map_tools.is_walkable(neighbour):
-                            border_tiles.add(neighbour)
-        return frozenset(border_tiles)
-    
+    def walkable(self) -> np.ndarray:
+        """The walkable tiles as a bool (height, width) array indexed [y, x]"""
+        return self.agent.map_grids.walkable
+
+    @cached_property
+    def terrain_border_mask(self) -> np.ndarray:
+        """The non-walkable tiles with a side on a walkable tile, as a bool array like walkable"""
+        return ~self.walkable & adjacent_to(self.walkable)
+
+    @cached_property
+    def terrain_borders(self) -> frozenset[Point2DI]:
+        ys, xs = np.nonzero(self.terrain_border_mask)
+        return frozenset(Point2DI(int(x), int(y)) for x, y in zip(xs, ys))
+
     def on_start(self):
-        self.regions = sorted(self.regions, key=lambda region: region.mid_point.x + region.mid_point.y, reverse=True)
-        i = 1
-        for region in self.regions:
-            region.on_start(i)
-            i += 1
+        self.load()
+        # Ties are broken by x so that the ids, which the map bundle stores, are the same every launch
+        self.regions = sorted(self.regions, key=lambda region: (region.mid_point.x + region.mid_point.y,
+                                                                region.mid_point.x), reverse=True)
+        self.labels = self.build_labels()
+        borders = border_tiles(self.labels)
+        for i, region in enumerate(self.regions, 1):
+            region.on_start(i, borders.get(i, np.zeros((0, 2))))
+        self.region_by_id: dict[int, Region] = {region.id: region for region in self.regions}
 
         # init cached:
         self.regions_as_centers = frozenset(region.center for region in self.regions)
         _ = self.terrain_borders
-        for y in range(self.agent.map_tools.height):
-            for x in range(self.agent.map_tools.width):
-                tile = Point2DI(x, y)
-                if self.agent.map_tools.is_walkable(x, y) or tile in self.terrain_borders:
-                    _ = self.get_region(tile)
+        self.region_tiles = self.walkable | self.terrain_border_mask
+        self.tile_labels, self.region_distance = load_or_build_many(
+            self.agent.map_bundle, ("tile_labels", "region_distance"), self.build_tile_labels)
+        self.atlas = PotentialAtlas(self)
+        if DEBUG_CONSOLE:
+            print(f"Potential atlas: {self.atlas.memory_usage() / 2 ** 20:.1f} MiB")
+        self.graph = RegionGraph(self)
+        self.chokepoint_index = PointIndex(self.graph.chokepoints, lambda chokepoint: chokepoint.center)
+        self.base_index = PointIndex(self.graph.bases, lambda base_location: base_location.position)
+        shape = self.labels.shape
+        self.nearest_chokepoint, self.nearest_base = load_or_build_many(
+            self.agent.map_bundle, ("nearest_chokepoint", "nearest_base"),
+            lambda: (self.chokepoint_index.voronoi(shape), self.base_index.voronoi(shape)))
         # _ = (self.get_region_by_center(region.center) for region in self.regions)
 
+    def build_labels(self) -> np.ndarray:
+        """
+        Returns the id the regions get in on_start, their index in regions plus one, of the region each tile is in,
+        as an int16 (height, width) array indexed [y, x], 0 outside of every region
+        """
+        labels = np.zeros((self.agent.map_tools.height, self.agent.map_tools.width), dtype=np.int16)
+        for region_id in range(len(self.regions), 0, -1):  # Where regions overlap, the tile goes to the first one
+            tiles = np.array(sorted(self.regions[region_id - 1].tiles_as_tuples), dtype=int).reshape(-1, 2)
+            labels[tiles[:, 1], tiles[:, 0]] = region_id
+        return labels
+
+    def build_tile_labels(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the id of the region get_region gives for each tile, the region it is in or the closest one, as an
+        int16 array like labels, 0 outside of region_tiles. And the Chebyshev distance in tiles from each tile to
+        that region, -1 outside of region_tiles.
+        """
+        nearest, distance = dilate_labels(self.labels, self.region_tiles)
+        return (np.where(self.region_tiles, nearest, 0).astype(np.int16),
+                np.where(self.region_tiles, distance, -1).astype(np.int16))
+
+    def get_region_ids(self, xs, ys) -> np.ndarray:
+        """Returns the id of the region each tile (xs[i], ys[i]) is in or closest to, 0 where get_region fails."""
+        xs = np.asarray(xs).astype(int)
+        ys = np.asarray(ys).astype(int)
+        ids = np.zeros(xs.shape, dtype=np.int16)
+        height, width = self.tile_labels.shape
+        valid = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        ids[valid] = self.tile_labels[ys[valid], xs[valid]]
+        return ids
+
+    def get_closest_chokepoint(self, tile_pos: Point2DI) -> Chokepoint:
+        """Returns the chokepoint with the center closest to the center of the tile"""
+        return self.chokepoint_index.items[self.nearest_chokepoint[tile_pos.y, tile_pos.x]]
+
+    def get_closest_base(self, tile_pos: Point2DI) -> BaseLocation:
+        """Returns the base location closest to the center of the tile"""
+        return self.base_index.items[self.nearest_base[tile_pos.y, tile_pos.x]]
+
     # Unused
     @cache
     def get_region_by_center(self, pos: Point2D) -> Region:
         return next((region for region in self.regions if region.center == pos), None)
 
-    @cache
     def get_exact_region(self, pos: Point2DI) -> Region | None:
         """Returns the region that the tile is in."""
-        return next((region for region in self.regions if pos in region.tiles), None)
+        if not (0 <= pos.y < self.labels.shape[0] and 0 <= pos.x < self.labels.shape[1]):
+            return None
+        return self.region_by_id.get(self.labels[pos.y, pos.x])
 
-    @cache
     def get_region(self, tile_pos: Point2DI) -> Region:
+        """Returns the region that the tile is in or closest to, see build_tile_labels."""
         tile_pos = tile_pos.as_tile()
-        if not (isinstance(tile_pos, Point2DI) and self.agent.map_tools.is_valid_tile(tile_pos) and (self.agent.map_tools.is_walkable(tile_pos.x, tile_pos.y) or tile_pos in self.terrain_borders)):
+        if not (isinstance(tile_pos, Point2DI) and self.agent.map_tools.is_valid_tile(tile_pos)
+                and self.region_tiles[tile_pos.y, tile_pos.x]):
             raise TypeError(f"pos must be of type Point2DI, not {type(tile_pos)}")
-        # sourcery skip: remove-unreachable-code
-        """Returns the region that the tile is in or closest to."""
-        if region := self.get_exact_region(tile_pos):
-            return region
-        # else
-        tile_groups = get_neighbours_within_distance(tile_pos, distance=6, ordered=True)
-        """for region in self.agent.region_manager.regions:
-            if any(tile in region.tiles for tile in tiles):
-                return region"""
-        for group in tile_groups:
-            for tile in group:
-                if region := self.get_exact_region(tile):
-                    return region
+        if region_id := self.tile_labels[tile_pos.y, tile_pos.x]:
+            return self.region_by_id[region_id]
         raise ValueError(f"Could not find region for tile {tile_pos}")
-        # return self.get_region_by_center(get_closest(self.regions_as_centers, pos))
 
 
 class Chokepoint:
@@ -0,0 +1,90 @@
+"""
+Streamline lookahead of the scout.
+
+PFscout.move takes the field at the scout's position and moves along it. integrate_streamline follows the field a few
+steps further, the way the scout would move if it kept steering by it, and returns the walkable part of that path.
+Moving towards the end of the path keeps the scout from turning back and forth where the field changes direction
+between frames, and a path stays a good waypoint for a few frames.
+
+The field is integrated as a direction field, each step moving h tiles along the normalised field, with the
+Heun-Euler pair: the Euler step p + h * k1 and Heun's step p + h / 2 * (k1 + k2) differ by h / 2 * |k2 - k1|, which is
+taken as the local error. k2 is evaluated at the Euler point of every candidate step length in one evaluate_field call
+and the longest step within the tolerance is taken.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import numpy as np
+from library import PLAYER_ENEMY, Point2D
+
+from modules.potential_flow.field import evaluate_field
+from modules.potential_flow.potentials import pack_units
+
+if TYPE_CHECKING:
+    from modules.py_unit import PyUnit
+    from modules.potential_flow.vector import Vector
+    from tasks.pf_scout import PFscout
+
+LOOKAHEAD_STEPS = 6  # Steps integrated ahead of the scout
+LOOKAHEAD_STEP = 2.0  # Longest step in tiles
+LOOKAHEAD_TOLERANCE = 0.1  # Largest accepted local error of a step in tiles
+STEP_FACTORS = np.array([1, 0.5, 0.25, 0.125])  # Candidate step lengths as fractions of the longest step
+WALKABLE_SPACING = 0.5  # Distance in tiles between the points checked for walkability along a step
+LOOKAHEAD_REACH = int(np.ceil(LOOKAHEAD_STEPS * LOOKAHEAD_STEP))  # Tiles the path can reach beyond the scout's sight
+
+
+def integrate_streamline(scout: PFscout, scout_unit: PyUnit, start: Point2D, first: Vector = None,
+                         steps: int = LOOKAHEAD_STEPS, max_step: float = LOOKAHEAD_STEP,
+                         tolerance: float = LOOKAHEAD_TOLERANCE, enemies=None) -> list[Point2D]:
+    """
+    Returns the path following the scout's field from start, at most steps segments long. The path starts with
+    start and ends early where it would leave the walkable tiles or the field vanishes.
+
+    :param first: The field at start if already known, e.g. from calculate_pval.
+    :param enemies: The enemies to take into account, all known enemies if None. PFscout passes the ones within
+        LOOKAHEAD_REACH tiles beyond the scout's sight, the ones the path can come close to.
+    """
+    if enemies is None:
+        enemies = scout.agent.unit_collection.get_group(PLAYER_ENEMY)
+    units = pack_units(scout, scout_unit, enemies)
+    pathable = scout.agent.map_grids.pathable
+
+    path = [start]
+    pos = np.array([start.x, start.y])
+    if first is not None:
+        k1 = direction(np.array([first.x, first.y]))
+    else:
+        k1 = direction(evaluate_field(scout, scout_unit, pos[None], units, attract=False)[0])
+    lengths = max_step * STEP_FACTORS
+
+    for _ in range(steps):
+        if not k1.any():
+            break
+        k2 = direction(evaluate_field(scout, scout_unit, pos + lengths[:, None] * k1, units, attract=False))
+        error = lengths / 2 * np.hypot(*(k2 - k1).T)
+        within = np.flatnonzero(error <= tolerance)
+        i = within[0] if len(within) else len(lengths) - 1
+        step = lengths[i] / 2 * (k1 + k2[i])
+        if not is_walkable_step(pathable, pos, step):
+            break
+        pos = pos + step
+        path.append(Point2D(float(pos[0]), float(pos[1])))
+        k1 = direction(evaluate_field(scout, scout_unit, pos[None], units, attract=False)[0])
+    return path
+
+
+def direction(field: np.ndarray) -> np.ndarray:
+    """Normalises the field vectors along the last axis, zero vectors stay zero"""
+    length = np.hypot(field[..., 0], field[..., 1])[..., None]
+    return np.divide(field, length, out=np.zeros_like(field), where=length > 0)
+
+
+def is_walkable_step(pathable: np.ndarray, pos: np.ndarray, step: np.ndarray) -> bool:
+    """Returns if the points along the step from pos, WALKABLE_SPACING apart, are all on pathable tiles"""
+    count = max(int(np.ceil(np.hypot(*step) / WALKABLE_SPACING)), 1)
+    points = pos + step * (np.arange(1, count + 1) / count)[:, None]
+    xs, ys = points.astype(int).T
+    height, width = pathable.shape
+    if (points < 0).any() or (xs >= width).any() or (ys >= height).any():
+        return False
+    return bool(pathable[ys, xs].all())
@@ -1,42 +1,121 @@
-import pygame
-from functools import singledispatchmethod
+from __future__ import annotations
+from math import atan2, hypot, pi
+from numbers import Real
+
 from library import Point2D
-from math import atan2, pi
 
 
-class Vector(pygame.Vector2):
+class Vector:
+    """
+    Mutable 2D vector of the potential flows.
+    Adding a Point2D gives a Point2D, so a flow can be added to a position directly. Every method taking another
+    vector accepts anything with x and y, Point2D included.
+    """
+    __slots__ = ("x", "y")
+
+    def __init__(self, x=0.0, y=None):
+        if y is None:
+            if isinstance(x, Real):
+                self.x = self.y = float(x)
+                return
+            x, y = x.x, x.y  # Vector or Point2D
+        self.x = float(x)
+        self.y = float(y)
+
+    def __repr__(self):
+        return f"Vector({self.x}, {self.y})"
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
+    def __eq__(self, other):
+        return isinstance(other, Vector) and self.x == other.x and self.y == other.y
+
+    __hash__ = None  # Mutable
+
+    def __bool__(self):
+        return self.x != 0 or self.y != 0
+
+    def __add__(self, other):
+        if isinstance(other, Point2D):
+            return Point2D(self.x + other.x, self.y + other.y)
+        return Vector(self.x + other.x, self.y + other.y)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Vector(self.x - other.x, self.y - other.y)
+
+    def __rsub__(self, other):
+        if isinstance(other, Point2D):
+            return Point2D(other.x - self.x, other.y - self.y)
+        return Vector(other.x - self.x, other.y - self.y)
+
+    def __mul__(self, other):
+        if isinstance(other, Real):   # NumPy scalars included, like the float32 of the atlas and obstacle grids
+            other = float(other)
+            return Vector(self.x * other, self.y * other)
+        return self.dot(other)
+
+    __rmul__ = __mul__
 
-    def __init__(self, *args, **kwargs):
-        if args and isinstance(args[0], Point2D):
-            args = args[0].x, args[0].y
-        super().__init__(*args, **kwargs)
+    def __truediv__(self, other: float):
+        return Vector(self.x / other, self.y / other)
+
+    def __neg__(self):
+        return Vector(-self.x, -self.y)
+
+    def __iadd__(self, other):
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def __isub__(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def __imul__(self, other: float):
+        other = float(other)
+        self.x *= other
+        self.y *= other
+        return self
+
+    def iadd_scaled(self, other, factor: float) -> Vector:
+        """self += other * factor without creating the intermediate vector"""
+        self.x += other.x * factor
+        self.y += other.y * factor
+        return self
+
+    def copy(self) -> Vector:
+        return Vector(self.x, self.y)
+
+    def length(self) -> float:
+        return hypot(self.x, self.y)
+
+    def length_squared(self) -> float:
+        return self.x * self.x + self.y * self.y
+
+    def dot(self, other) -> float:
+        return self.x * other.x + self.y * other.y
+
+    def cross(self, other) -> float:
+        return self.x * other.y - self.y * other.x
 
-    @singledispatchmethod
     def cos(self, other) -> float:
-        if not (self and other):
+        norms = hypot(self.x, self.y) * hypot(other.x, other.y)
+        if not norms:
             return 0
-        return self.dot(other) / (self.length() * other.length())
+        return (self.x * other.x + self.y * other.y) / norms
 
-    @cos.register
-    def _(self, other: Point2D) -> float:
-        return self.cos(Vector(other))
-
-    @singledispatchmethod
     def sin(self, other) -> float:
-        if not (self and other):
+        norms = hypot(self.x, self.y) * hypot(other.x, other.y)
+        if not norms:
             return 0
-        return self.cross(other) / (self.length() * other.length())
-
-    @sin.register
-    def _(self, other: Point2D) -> float:
-        return self.sin(Vector(other))
+        return (self.x * other.y - self.y * other.x) / norms
 
-    def angle_to(self, other: 'Vector') -> float:
+    def angle_to(self, other) -> float:
         # Calculate the angle between this vector and another vector
         angle = atan2(self.sin(other), self.cos(other))
         return (angle + 2 * pi) % (2 * pi)    # [-pi, pi] -> [0, 2pi]
-
-    def __add__(self, other):
-        if isinstance(other, Point2D):
-            return Point2D(self.x + other.x, self.y + other.y)
-        return super().__add__(other)
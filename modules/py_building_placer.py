@@ -63,20 +63,23 @@ class PyBuildingPlacer:
         return None
 
     def find_walloff_position(self, type_to_build: UnitType) -> Point2DI:   # Gjord av ERIk
-        """ Finds a location on a bottlenecks starting at the ones closest to the home base """
-
-        # All supply depots
-        return_set = set(self.agent.unit_collection.py_units.values())
-        new_set = {py_unit for py_unit in return_set if py_unit.unit_type.unit_typeid == (UNIT_TYPEID.TERRAN_SUPPLYDEPOT or UNIT_TYPEID.TERRAN_SUPPLYDEPOTLOWERED)}
-        upcoming_supply_depots = [t.pos for t in
-                    self.agent.task_manager.current_tasks.get_tasks(build.Build, None).union(
-                        self.agent.task_manager.task_queue.get_tasks(build.Build, None)) if
-                    t.building_type.unit_typeid == (UNIT_TYPEID.TERRAN_SUPPLYDEPOT or UNIT_TYPEID.TERRAN_SUPPLYDEPOT) and t.pos]
-
-        for bottleneck in self.agent.BOTTLENECKS:
-            for tile in bottleneck:
-                if tile not in list(new_set) + upcoming_supply_depots:
-                    return tile
+        """ Finds the first free position of the walloff layout, which starts at the bottlenecks closest to the home
+        base """
+
+        # The tiles of all supply depots, built or upcoming
+        occupied = set()
+        for py_unit in self.agent.unit_collection.get_group(PLAYER_SELF, UNIT_TYPEID.TERRAN_SUPPLYDEPOT,
+                                                            UNIT_TYPEID.TERRAN_SUPPLYDEPOTLOWERED):
+            occupied.update(footprint_tiles(round(py_unit.position.x - type_to_build.tile_width / 2),
+                                            round(py_unit.position.y - type_to_build.tile_height / 2), type_to_build))
+        for t in self.agent.task_manager.current_tasks.get_tasks(build.Build, None).union(
+                self.agent.task_manager.task_queue.get_tasks(build.Build, None)):
+            if t.building_type.unit_typeid == UNIT_TYPEID.TERRAN_SUPPLYDEPOT and t.pos:
+                occupied.update(footprint_tiles(t.pos.x, t.pos.y, type_to_build))
+
+        for pos in self.agent.WALLOFF_LAYOUT:
+            if occupied.isdisjoint(footprint_tiles(pos.x, pos.y, type_to_build)):
+                return pos
         return None
 
     def can_build_addon(self, candidate: PyUnit) -> bool:
@@ -158,3 +161,8 @@ class PyBuildingPlacer:
             return None
 
         return Point2D(pos)
+
+
+def footprint_tiles(x: int, y: int, building_type: UnitType) -> list[tuple[int, int]]:
+    """The tiles of a building placed with its lowest tile at (x, y)"""
+    return [(x + dx, y + dy) for dx in range(building_type.tile_width) for dy in range(building_type.tile_height)]
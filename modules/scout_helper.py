@@ -1,8 +1,7 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
-from modules.extra import get_closest
-from library import Point2D, Point2DI, PLAYER_ENEMY, UnitType
+from library import Point2D, Point2DI, PLAYER_ENEMY, UNIT_TYPEID, UnitType
 from modules.py_unit import PyUnit
 from functools import cache
 
@@ -27,14 +26,11 @@ def get_enemy_info(agent: BasicAgent):
 
 
 def get_closest_choke_pos(agent: BasicAgent, py_unit: PyUnit) -> Point2DI:
-    chokepoints_as_centers = agent.region_manager.chokepoints_as_centers
-    return get_closest(chokepoints_as_centers, py_unit.position)
+    return agent.region_manager.graph.closest_chokepoint(py_unit.position).center
 
 
 def get_closest_choke_to_position(self, position):
-    return get_closest(
-        self.agent.region_manager.chokepoints, position, lambda c: c.center
-    )
+    return self.agent.region_manager.graph.closest_chokepoint(position)
 
 
 def get_enemy_expansion_info(agent: BasicAgent) -> tuple[Point2D, Region]:
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from typing import Callable, Generic, Iterable, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+BRUTE_FORCE_SIZE = 64  # Up to this many points a plain scan is faster than the numpy work of a grid query
+
+
+class GridIndex:
+    """
+    Spatial index over a fixed set of 2D points, bucketed in a uniform grid of square cells.
+
+    A radius query only looks at the cells overlapping the query circle, so it costs O(points nearby) instead of
+    O(all points). A nearest query looks at growing squares of cells around the query point until no cell outside of
+    the square can hold a closer point. The points are stored sorted by cell, so every bucket is a contiguous slice of
+    self.points.
+    """
+
+    def __init__(self, points, cell_size: float = 4):
+        self.cell_size = cell_size
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        cells = np.floor(points / cell_size).astype(int)
+        self.order = np.lexsort((cells[:, 1], cells[:, 0]))
+        self.points = points[self.order]
+        cells = cells[self.order]
+
+        self.buckets: dict[tuple[int, int], tuple[int, int]] = {}
+        self.min_cell = tuple(cells.min(axis=0).tolist()) if len(cells) else (0, 0)
+        self.max_cell = tuple(cells.max(axis=0).tolist()) if len(cells) else (-1, -1)
+        if len(cells):
+            starts = np.flatnonzero(np.any(np.diff(cells, axis=0) != 0, axis=1)) + 1
+            starts = np.concatenate(([0], starts))
+            ends = np.concatenate((starts[1:], [len(cells)]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                self.buckets[(int(cells[start, 0]), int(cells[start, 1]))] = (start, end)
+
+    def __len__(self):
+        return len(self.points)
+
+    def query_radius_indices(self, x: float, y: float, radius: float) -> np.ndarray:
+        """Returns the indices into self.points of the points strictly closer than radius to (x, y)"""
+        candidates = self.cell_indices(int(np.floor((x - radius) / self.cell_size)),
+                                       int(np.floor((x + radius) / self.cell_size)),
+                                       int(np.floor((y - radius) / self.cell_size)),
+                                       int(np.floor((y + radius) / self.cell_size)))
+        near = self.points[candidates]
+        d2 = (near[:, 0] - x) ** 2 + (near[:, 1] - y) ** 2
+        return candidates[d2 < radius * radius]
+
+    def k_nearest_indices(self, x: float, y: float, k: int) -> np.ndarray:
+        """Returns the indices into self.points of the k points closest to (x, y), closest first"""
+        k = min(k, len(self.points))
+        if not k:
+            return np.empty(0, dtype=int)
+        cx = int(np.floor(x / self.cell_size))
+        cy = int(np.floor(y / self.cell_size))
+        reach = max(cx - self.min_cell[0], self.max_cell[0] - cx, cy - self.min_cell[1], self.max_cell[1] - cy, 0)
+        for ring in range(reach + 1):
+            candidates = self.cell_indices(cx - ring, cx + ring, cy - ring, cy + ring)
+            if len(candidates) < k:
+                continue
+            near = self.points[candidates]
+            d2 = (near[:, 0] - x) ** 2 + (near[:, 1] - y) ** 2
+            closest = np.argsort(d2, kind="stable")[:k]
+            # The points in the cells outside of the ring are at least ring cells away
+            if d2[closest[-1]] <= (ring * self.cell_size) ** 2 or ring == reach:
+                return candidates[closest]
+
+    def nearest_index(self, x: float, y: float) -> int:
+        """Returns the index into self.points of the point closest to (x, y), -1 if there are no points"""
+        closest = self.k_nearest_indices(x, y, 1)
+        return int(closest[0]) if len(closest) else -1
+
+    def cell_indices(self, min_cx: int, max_cx: int, min_cy: int, max_cy: int) -> np.ndarray:
+        """Returns the indices into self.points of the points in the cells of the given inclusive range"""
+        slices = [np.arange(*bucket)
+                  for cx in range(max(min_cx, self.min_cell[0]), min(max_cx, self.max_cell[0]) + 1)
+                  for cy in range(max(min_cy, self.min_cell[1]), min(max_cy, self.max_cell[1]) + 1)
+                  if (bucket := self.buckets.get((cx, cy)))]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=int)
+
+    def query_radius(self, x: float, y: float, radius: float) -> np.ndarray:
+        """Returns the points strictly closer than radius to (x, y) as a (k, 2) array"""
+        return self.points[self.query_radius_indices(x, y, radius)]
+
+
+class PointIndex(Generic[T]):
+    """
+    Nearest neighbour queries over a fixed list of items with a position, like the chokepoints or the base locations.
+    Sets of up to BRUTE_FORCE_SIZE items are scanned, larger ones are queried through a GridIndex.
+    """
+
+    def __init__(self, items: Iterable[T], position: Callable[[T], object] = lambda item: item, cell_size: float = 16):
+        self.items: list[T] = list(items)
+        positions = [position(item) for item in self.items]
+        self.points = np.array([(point.x, point.y) for point in positions], dtype=float).reshape(-1, 2)
+        self.index = GridIndex(self.points, cell_size)
+        self.coordinates: list[tuple[float, float]] = [tuple(point) for point in self.points.tolist()]
+
+    def __len__(self):
+        return len(self.items)
+
+    def nearest(self, position) -> T | None:
+        """Returns the item closest to the position, None if there are no items"""
+        if len(self.items) <= BRUTE_FORCE_SIZE:
+            x, y = position.x, position.y
+            return min(zip(self.items, self.coordinates), default=(None,),
+                       key=lambda pair: (pair[1][0] - x) ** 2 + (pair[1][1] - y) ** 2)[0]
+        i = self.index.nearest_index(position.x, position.y)
+        return self.items[self.index.order[i]] if i >= 0 else None
+
+    def k_nearest(self, position, k: int) -> list[T]:
+        """Returns the k items closest to the position, closest first"""
+        return [self.items[i] for i in self.index.order[self.index.k_nearest_indices(position.x, position.y, k)]]
+
+    def voronoi(self, shape: tuple[int, int]) -> np.ndarray:
+        """See nearest_raster, the raster holds indices into self.items"""
+        return nearest_raster(self.points, shape)
+
+
+def nearest_raster(points, shape: tuple[int, int], rows: int = 32) -> np.ndarray:
+    """
+    Returns the index of the point closest to the center of each tile as an int16 (height, width) array indexed
+    [y, x], the lowest index on a tie, -1 if there are no points. Computed rows at a time to bound the memory used.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    height, width = shape
+    raster = np.full(shape, -1, dtype=np.int16)
+    if not len(points):
+        return raster
+    xs = np.arange(width) + 0.5
+    for top in range(0, height, rows):
+        ys = np.arange(top, min(top + rows, height)) + 0.5
+        d2 = ((xs[None, :, None] - points[:, 0]) ** 2 + (ys[:, None, None] - points[:, 1]) ** 2)
+        raster[top:top + len(ys)] = d2.argmin(axis=2)
+    return raster
@@ -262,10 +262,14 @@ class TaskManager:
             base.is_player_start_location(PLAYER_SELF) or base.is_player_start_location(PLAYER_ENEMY))]
         # Calculating distance from PLAYER_ENEMY starting base location to all
         # other potential bases.
-        bases_pos.sort(
-            key=lambda p: int(
-                self.agent.map_tools.get_ground_distance(
-                    enemy_base_pos, p)))
+        if USE_PFSCOUT:
+            graph = self.agent.region_manager.graph
+            bases_pos.sort(key=lambda p: graph.ground_distance(enemy_base_pos, p))
+        else:
+            bases_pos.sort(
+                key=lambda p: int(
+                    self.agent.map_tools.get_ground_distance(
+                        enemy_base_pos, p)))
 
         scout_bases = SimpleQueue()
         # Add the two bases closest to the enemy base, with the furthest added first
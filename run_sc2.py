@@ -40,6 +40,9 @@ def run_sc2(bot1: Optional[IDABot] = None,
     coordinator.launch_starcraft()
 
     path = os.path.join(os.getcwd(), "maps", random.choice(maps))
+    for bot in (bot1, bot2):
+        if bot:
+            bot.map_path = path  # Key of the bot's precompiled map data
     coordinator.start_game(path)
 
     while coordinator.update():
@@ -7,12 +7,8 @@ if TYPE_CHECKING:
 
 from library import Point2D
 from tasks.task import Task, Status
+from modules.path_finding.flow_field import WAYPOINT_TILES
 
-#added by hanlu520
-from modules.path_finding.custom_priority_queue import CustomPriorityQueue
-from modules.path_finding.vertex import Vertex
-from modules.path_finding.lpa_star import *
-import copy
 
 
 class Move(Task):
@@ -24,7 +20,8 @@ class Move(Task):
         self.previous_pos: Optional[Point2D] = None
         self.fails: int = 0
         self.frame_counter = 0
-        self.agent = agent        
+        self.agent = agent
+        self.waypoint: Optional[tuple[float, float]] = None  # Last position the unit was sent to
         
 
     def on_start(self, py_unit: PyUnit) -> Status:
@@ -32,37 +29,27 @@ class Move(Task):
         Start or restart the task.
         :return: Status.DONE if the task is started.
         """
-        #- init for LPA* - hanlu520
-        start_position = (int(round(py_unit.position.x)), int(round(py_unit.position.y)))
-        target_position = (int(round(self.target.x)), int(round(self.target.y)))    
-        print("STARTPOS_ ", start_position)
-        print("MÅLPOS_ ", target_position)
-        if(not self.agent.map_tools.is_walkable(start_position[0], start_position[1])):
-            print("Startpositionen är inte walkable")
+        # Along the flow field of the target - hanlu520
+        if not self.agent.map_grids.is_walkable(py_unit.position):
             return Status.FAIL
-
-        priority_queue = CustomPriorityQueue()
-        secondary_queue = []
-        vertexes = copy.copy(self.agent.vertex_dict)
-        vertexes[start_position].rhs_value = 0
-        #self.agent.vertex_dict[start_position].parent = None
-        vertexes[target_position].child = None
-
-        if(not self.agent.map_tools.is_walkable(start_position[0], start_position[1])):
-            print("Startpositionen är inte walkable")
-            return Status.FAIL
-
-        initial_key_value = calculateKey(vertexes, start_position, target_position)
-        priority_queue.put((initial_key_value, start_position))
-        # secondary_queue.append((initial_key_value, start_position))
-        path = computeShortestPath(priority_queue, secondary_queue, vertexes, start_position, target_position)
-        print("PATH_ ", path)
-
-        py_unit.move(self.target)
+        self.waypoint = None
+        self.follow_flow(py_unit)
         self.previous_pos = py_unit.position
         return Status.DONE
 
-    
+    def follow_flow(self, py_unit: PyUnit):
+        """
+        Moves the unit to the waypoint WAYPOINT_TILES down the flow field of the target, which every unit heading
+        there shares, or straight to the target when it is closer or cannot be reached. The move is only issued when
+        the waypoint changed, so units sharing a target do not flood the action queue.
+        """
+        waypoint = self.agent.flow_fields.next_waypoint(py_unit.position, self.target, WAYPOINT_TILES)
+        if waypoint is None:
+            waypoint = self.target
+        if (waypoint.x, waypoint.y) != self.waypoint:
+            self.waypoint = (waypoint.x, waypoint.y)
+            py_unit.move(waypoint)
+
     
     
     
@@ -92,6 +79,7 @@ class Move(Task):
                     return Status.FAIL
             else:
                 # We're still on the move.
+                self.follow_flow(py_unit)
                 self.fails = 0
                 self.previous_pos = py_unit.position
                 return Status.NOT_DONE
@@ -9,10 +9,12 @@ from config import (
     OLD_ENEMIES_ENABLED,
     FRAME_SKIP_SCOUT,
 )
-from modules.extra import get_closest
 
+from modules.potential_flow.obstacles import ObstacleField
 from modules.potential_flow.regions import Region
-from modules.potential_flow.potentials import calculate_pval
+from modules.potential_flow.field_cache import FieldCache, field_inputs
+from modules.potential_flow.potentials import calculate_pval, enemies_in_sight, gather_enemies
+from modules.potential_flow.streamline import LOOKAHEAD_REACH, integrate_streamline
 from modules.potential_flow.vector import Vector
 from tasks.task import Status
 
@@ -69,6 +71,15 @@ class PFscout(Scout):
 
 
         self.USE_EXTRA_ATTR = True
+        self.USE_BORDER_SEGMENTS = True  # Border as line potentials along fitted segments instead of per tile
+        self.USE_ATLAS = True  # Look up the region and border flows in region_manager.atlas
+        self.USE_OBSTACLE_FIELD = True  # Keep the static obstacles summed in obstacle_field instead of live
+        self.obstacle_field: ObstacleField = None
+        self.MULTIPOLE_TOLERANCE = 0  # Barnes-Hut tolerance when summing many unit obstacles, 0 sums them exactly
+        self.USE_LOOKAHEAD = True  # Move towards the end of the field's streamline instead of along the field
+        self.lookahead: list[Point2D] = []
+        self.USE_FIELD_CACHE = True  # Reuse the last field while its inputs have not changed, see field_cache
+        self.field_cache = FieldCache()
 
         if DEBUG_SCOUT:
             self.region_potentials: list[Vector] = []
@@ -82,6 +93,7 @@ class PFscout(Scout):
             self.show_region_p = True
             self.show_border_p = True
             self.show_all_p = False
+            self.show_lookahead = True
 
         add_expire_instance(self.agent, self)
         add_expire_function(self.agent, self, self.get_next_target, 200)
@@ -104,6 +116,9 @@ class PFscout(Scout):
         Status.FAIL if unit not suitable.
         """
 
+        if self.obstacle_field is None:
+            self.obstacle_field = ObstacleField(self.agent.region_manager)
+
         self.region_10 = next(
             region for region in self.agent.region_manager.regions if region.id == 10
         )
@@ -172,6 +187,10 @@ class PFscout(Scout):
                 self.agent.map_tools.draw_line(scout_pos, p + scout_pos, Color.BLACK)
                 self.agent.map_tools.draw_circle(p + scout_pos, 2, Color.BLACK)
 
+        if self.show_lookahead:
+            for p1, p2 in zip(self.lookahead, self.lookahead[1:]):
+                self.agent.map_tools.draw_line(p1, p2, Color.GREEN)
+
     def near_reach_pos(self, pos1, pos2, dist=1):
         return pos1.distance(pos2) < dist
 
@@ -182,20 +201,39 @@ class PFscout(Scout):
 
         this_target = py_unit.position
 
-        # reverse all flows values if needed
-        should_reverse = self.forward
-        self.reverse_flows(should_reverse)
-        speed = calculate_pval(self, py_unit)
-        # reverse back
-        self.reverse_flows(should_reverse)
+        if self.USE_LOOKAHEAD:
+            # Gathered once: the enemies the lookahead can come close to, and among them the ones in sight
+            nearby = gather_enemies(self, py_unit, LOOKAHEAD_REACH)
+            enemies = enemies_in_sight(py_unit, nearby)
+        else:
+            nearby = enemies = gather_enemies(self, py_unit)
+        inputs = field_inputs(self, py_unit, nearby) if self.USE_FIELD_CACHE else None
+        cached = self.field_cache.get(inputs) if self.USE_FIELD_CACHE else None
+        if cached is not None:
+            speed, self.lookahead = cached
+        else:
+            # reverse all flows values if needed
+            should_reverse = self.forward
+            self.reverse_flows(should_reverse)
+            speed = calculate_pval(self, py_unit, enemies)
+            if self.USE_LOOKAHEAD:
+                self.lookahead = integrate_streamline(self, py_unit, scout_pos, speed, enemies=nearby)
+            # reverse back
+            self.reverse_flows(should_reverse)
+            if self.USE_FIELD_CACHE:
+                self.field_cache.put(inputs, (speed, self.lookahead))
 
-        # Find valid position
         self.forward = 1
         self.scout_target = scout_pos + speed
+        if len(self.lookahead) > 1:
+            py_unit.move(self.lookahead[-1])
+            return
+
+        # Find valid position
         ratio = 1 / speed.length()
         seg = speed * ratio
         this_target = (seg * 3) + this_target
-        while not self.agent.map_tools.is_walkable(Point2DI(this_target)):
+        while not self.agent.map_grids.is_pathable(this_target):
             this_target = seg + this_target
 
             if self.agent.map_tools.is_valid_position(this_target):
@@ -244,9 +282,7 @@ class PFscout(Scout):
         """Scout enemy opening"""
         enemy_start_pos, enemy_start_region = get_enemy_info(self.agent)
 
-        waypoint = get_closest(
-            self.agent.region_manager.chokepoints_as_centers, enemy_start_pos
-        )
+        waypoint = self.agent.region_manager.get_closest_chokepoint(enemy_start_pos.as_tile()).center
 
         closest_choke_pos = get_closest_choke_pos(self.agent, py_unit)
         cur_region = self.agent.region_manager.get_region(py_unit.tile_position)
@@ -316,11 +352,7 @@ class PFscout(Scout):
     @cache
     def get_next_target_old(self, py_unit: PyUnit) -> Point2D:
         """Get next target position"""
-        closest_enemy_base = get_closest(
-            self.agent.non_start_bases,
-            get_enemy_base_location(self.agent),
-            lambda base: base.position,
-        )
+        closest_enemy_base = self.agent.non_start_base_index.nearest(get_enemy_base_location(self.agent))
         if not self.use_old_next_target_method:
             if closest_enemy_base.contains_position(py_unit.position):
                 if any(
@@ -339,9 +371,7 @@ class PFscout(Scout):
         self, next_target_pos: Point2D, switch: callable = None
     ) -> bool:
         """Validate expansion target"""
-        target_base = get_closest(
-            self.agent.non_start_bases, next_target_pos, lambda base: base.position
-        )
+        target_base = self.agent.non_start_base_index.nearest(next_target_pos)
         if self.agent.map_tools.is_visible(
             int(next_target_pos.x), int(next_target_pos.y)
         ) and target_base not in self.agent.base_location_manager.get_occupied_base_locations(